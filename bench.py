@@ -0,0 +1,203 @@
+import os
+import time
+import random
+import shutil
+import sqlite3
+import logging
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from datetime import date, timedelta
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+# Raw column C formats mixed into the synthetic sheet
+RAW_DATE_FORMATS = ["%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d/%m/%y", "%m/%d/%Y"]
+
+# Scratch PostgreSQL table used by the insert benchmarks (never the real cookstoves table)
+BENCH_TABLE = "cookstoves_bench"
+
+def make_serial(i):
+    """Return the synthetic serial number for index i."""
+    return f"SN{i:08d}"
+
+def make_raw_rows(size, seed=42):
+    """Return a synthetic 'Clean Record' sheet (header + `size` rows) with mixed date formats."""
+    rng = random.Random(seed)
+    first_day = date(2023, 1, 1)
+    rows = [["Serial Number", "Model", "Manufacture Date"]]
+    for i in range(size):
+        day = first_day + timedelta(days=rng.randrange(730))
+        rows.append([make_serial(i), "JIKO", day.strftime(rng.choice(RAW_DATE_FORMATS))])
+    return rows
+
+def make_fixtures(directory, size, missing_fraction=0.02, seed=42):
+    """
+    Write processed_data.db (clean_record) and local_data.db (cookstoves_local)
+    into `directory`. A `missing_fraction` of the serial numbers is left out
+    of local_data.db. Returns the number of missing serial numbers.
+    """
+    rng = random.Random(seed)
+    first_day = date(2023, 1, 1)
+    processed_rows = [
+        (make_serial(i), (first_day + timedelta(days=rng.randrange(730))).strftime("%Y-%m-%d %H:%M:%S"))
+        for i in range(size)
+    ]
+    missing = set(rng.sample(range(size), int(size * missing_fraction)))
+
+    for name in ("processed_data.db", "local_data.db", "missing_data.db"):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    with sqlite3.connect(os.path.join(directory, "processed_data.db")) as conn:
+        conn.execute("CREATE TABLE clean_record (column_a TEXT, column_c TEXT)")
+        conn.executemany("INSERT INTO clean_record (column_a, column_c) VALUES (?, ?)", processed_rows)
+        conn.commit()
+
+    with sqlite3.connect(os.path.join(directory, "local_data.db")) as conn:
+        conn.execute("CREATE TABLE cookstoves_local (id INTEGER, serial_number TEXT, manufacture_date TEXT)")
+        conn.executemany(
+            "INSERT INTO cookstoves_local (id, serial_number, manufacture_date) VALUES (?, ?, ?)",
+            ((i, serial, made) for i, (serial, made) in enumerate(processed_rows) if i not in missing)
+        )
+        conn.commit()
+    return len(missing)
+
+def bench_process_data(size, seed):
+    """Time gsheetfetch.process_data over a synthetic sheet."""
+    import gsheetfetch
+    rows = make_raw_rows(size, seed)
+    started = time.perf_counter()
+    gsheetfetch.process_data(rows)
+    return size, time.perf_counter() - started
+
+def _bench_check_and_store(module_name):
+    """Time a check_and_store_missing_data entry point against the fixtures in the cwd."""
+    module = __import__(module_name)
+    with sqlite3.connect("processed_data.db") as conn:
+        size = conn.execute("SELECT COUNT(*) FROM clean_record").fetchone()[0]
+    started = time.perf_counter()
+    module.check_and_store_missing_data(force=True)
+    return size, time.perf_counter() - started
+
+def bench_compare(size, seed):
+    return _bench_check_and_store("compare")
+
+def bench_dbfetch(size, seed):
+    return _bench_check_and_store("dbfetch")
+
+def _bench_insert(size, seed, method):
+    """Time insert_data_into_postgres into a scratch table on the configured PostgreSQL server."""
+    import migrationtopsql
+    from psycopg2 import sql
+
+    migrationtopsql.POSTGRES_TABLE = BENCH_TABLE
+    with sqlite3.connect("processed_data.db") as conn:
+        rows = conn.execute("SELECT column_a, column_c FROM clean_record").fetchall()
+
+    conn = migrationtopsql.connect_to_postgres()
+    try:
+        cursor = conn.cursor()
+        table = sql.Identifier(BENCH_TABLE)
+        cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(table))
+        cursor.execute(sql.SQL("""
+            CREATE TABLE {} (
+                id SERIAL PRIMARY KEY,
+                serial_number TEXT UNIQUE,
+                manufacture_date TIMESTAMP
+            )
+        """).format(table))
+        conn.commit()
+
+        columns = migrationtopsql.get_postgres_table_columns(conn)
+        started = time.perf_counter()
+        migrationtopsql.insert_data_into_postgres(conn, rows, columns, method=method)
+        elapsed = time.perf_counter() - started
+
+        cursor.execute(sql.SQL("DROP TABLE {}").format(table))
+        conn.commit()
+        return len(rows), elapsed
+    finally:
+        conn.close()
+
+def bench_insert_copy(size, seed):
+    return _bench_insert(size, seed, "copy")
+
+def bench_insert_values(size, seed):
+    return _bench_insert(size, seed, "values")
+
+def bench_insert_row(size, seed):
+    return _bench_insert(size, seed, "row")
+
+BENCHMARKS = {
+    "process_data": bench_process_data,
+    "compare.check_and_store_missing_data": bench_compare,
+    "dbfetch.check_and_store_missing_data": bench_dbfetch,
+    "insert_data_into_postgres[copy]": bench_insert_copy,
+    "insert_data_into_postgres[values]": bench_insert_values,
+    "insert_data_into_postgres[row]": bench_insert_row,
+}
+
+def reset_run_dir(fixtures_dir, run_dir):
+    """
+    Replace run_dir with a copy of the pristine fixtures, so no benchmark sees
+    the indexes, run manifest or outputs left behind by an earlier one.
+    """
+    shutil.rmtree(run_dir, ignore_errors=True)
+    shutil.copytree(fixtures_dir, run_dir)
+
+def _run_benchmark(name, directory, size, seed):
+    """Worker entry point: run one benchmark in `directory` and report its peak RSS."""
+    os.chdir(directory)
+    logging.disable(logging.INFO)
+    rows, seconds = BENCHMARKS[name](size, seed)
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rows, seconds, peak_rss_kb
+
+def run_isolated(name, directory, size, seed):
+    """Run one benchmark in a fresh interpreter so its peak RSS is not shared with others."""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(_run_benchmark, (name, directory, size, seed))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic fixtures.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="number of serials per fixture")
+    parser.add_argument("--missing-fraction", type=float, default=0.02, help="fraction of serials absent from local_data.db")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--postgres", action="store_true",
+        help=f"also benchmark inserts into a scratch '{BENCH_TABLE}' table using POSTGRES_CONFIG"
+    )
+    parser.add_argument("--with-row-inserts", action="store_true", help="include the slow one-INSERT-per-row method")
+    parser.add_argument("--dir", help="directory for the fixtures (kept after the run); defaults to a temporary one")
+    args = parser.parse_args()
+
+    names = ["process_data", "compare.check_and_store_missing_data", "dbfetch.check_and_store_missing_data"]
+    if args.postgres:
+        names += ["insert_data_into_postgres[copy]", "insert_data_into_postgres[values]"]
+        if args.with_row_inserts:
+            names.append("insert_data_into_postgres[row]")
+
+    directory = args.dir or tempfile.mkdtemp(prefix="dbupdater-bench-")
+    os.makedirs(directory, exist_ok=True)
+    try:
+        print(f"{'size':>10}  {'benchmark':<40} {'rows':>10} {'seconds':>9} {'rows/sec':>12} {'peak RSS MB':>12}")
+        for size in args.sizes:
+            fixtures_dir = os.path.join(directory, f"fixtures-{size}")
+            run_dir = os.path.join(directory, "run")
+            os.makedirs(fixtures_dir, exist_ok=True)
+            make_fixtures(fixtures_dir, size, args.missing_fraction, args.seed)
+            for name in names:
+                reset_run_dir(fixtures_dir, run_dir)
+                rows, seconds, peak_rss_kb = run_isolated(name, run_dir, size, args.seed)
+                rate = rows / seconds if seconds else float("inf")
+                print(f"{size:>10}  {name:<40} {rows:>10} {seconds:>9.3f} {rate:>12,.0f} {peak_rss_kb / 1024:>12.1f}")
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
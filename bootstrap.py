@@ -0,0 +1,121 @@
+import os
+import json
+import logging
+import importlib
+import threading
+from datetime import datetime, timedelta
+
+# Directory where Google API discovery documents are cached between runs
+DISCOVERY_CACHE_DIR = ".discovery_cache"
+
+# OAuth token written by the first interactive login and reused afterwards
+TOKEN_FILE = "token.json"
+
+# Refresh the access token when it expires within this margin
+REFRESH_MARGIN = timedelta(minutes=5)
+
+class _LazyModule:
+    """Stand-in for a module that is imported on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+def lazy_import(name):
+    """
+    Return a proxy for the module `name` that is only imported when one of its
+    attributes is first used, so scripts do not pay for the Google or
+    psycopg2 imports of stages they never run.
+    """
+    return _LazyModule(name)
+
+google_credentials = lazy_import("google.oauth2.credentials")
+google_requests = lazy_import("google.auth.transport.requests")
+google_oauthlib_flow = lazy_import("google_auth_oauthlib.flow")
+discovery = lazy_import("googleapiclient.discovery")
+discovery_cache = lazy_import("googleapiclient.discovery_cache")
+
+_discovery_docs = {}
+_discovery_lock = threading.Lock()
+
+def load_discovery_document(api, version):
+    """
+    Return the discovery document of a Google API as a JSON string.
+    The document is kept in process, cached under DISCOVERY_CACHE_DIR, and
+    otherwise taken from the copy bundled with googleapiclient, so building a
+    service needs no discovery request.
+    """
+    key = (api, version)
+    with _discovery_lock:
+        if key in _discovery_docs:
+            return _discovery_docs[key]
+
+        path = os.path.join(DISCOVERY_CACHE_DIR, f"{api}.{version}.json")
+        document = None
+        if os.path.exists(path):
+            with open(path) as f:
+                document = f.read()
+        else:
+            document = discovery_cache.get_static_doc(api, version)
+            if document is None:
+                raise RuntimeError(f"No bundled discovery document for {api} {version}.")
+            os.makedirs(DISCOVERY_CACHE_DIR, exist_ok=True)
+            with open(path, "w") as f:
+                f.write(document)
+            logging.info(f"Cached discovery document for {api} {version} in {path}.")
+
+        _discovery_docs[key] = document
+        return document
+
+def build_service(api, version, credentials):
+    """Build a Google API service from the cached discovery document (no discovery request)."""
+    return discovery.build_from_document(json.loads(load_discovery_document(api, version)), credentials=credentials)
+
+_credentials = None
+_credentials_lock = threading.Lock()
+
+def _expires_soon(creds):
+    """True if the credentials are invalid or their access token expires within REFRESH_MARGIN."""
+    if not creds.valid:
+        return True
+    return creds.expiry is not None and creds.expiry - datetime.utcnow() < REFRESH_MARGIN
+
+def _save_token(creds, token_file):
+    """Write the credentials back to token.json for the next run."""
+    with open(token_file, "w") as token:
+        token.write(creds.to_json())
+
+def get_credentials(scopes, client_secrets_path, token_file=TOKEN_FILE):
+    """
+    Return OAuth credentials for `scopes`, cached in process.
+    token.json is read once per process; the access token is refreshed shortly
+    before it expires (and saved back), and the interactive login only runs
+    when there is no usable refresh token.
+    """
+    global _credentials
+    with _credentials_lock:
+        creds = _credentials
+        if creds is None and os.path.exists(token_file):
+            creds = google_credentials.Credentials.from_authorized_user_file(token_file)
+        if creds is not None and not _expires_soon(creds):
+            _credentials = creds
+            return creds
+
+        if creds and creds.refresh_token:
+            creds.refresh(google_requests.Request())
+            logging.info("Refreshed Google access token.")
+        else:
+            flow = google_oauthlib_flow.InstalledAppFlow.from_client_secrets_file(client_secrets_path, scopes)
+            creds = flow.run_local_server(port=0)
+        _save_token(creds, token_file)
+        _credentials = creds
+        return creds
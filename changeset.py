@@ -0,0 +1,46 @@
+import os
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+# Columns of an exported change set (the missing rows of one diff run)
+CHANGESET_SCHEMA = pa.schema([
+    ("serial_number", pa.string()),
+    ("manufacture_date", pa.string()),
+])
+
+def rows_to_table(rows):
+    """Build an Arrow table from (serial_number, manufacture_date) rows, with "NULL" as a real null."""
+    columns = list(zip(*rows)) if rows else [(), ()]
+    arrays = [pa.array([None if value == "NULL" else value for value in column], type=pa.string()) for column in columns]
+    return pa.Table.from_arrays(arrays, schema=CHANGESET_SCHEMA)
+
+def write_changeset(rows, path):
+    """
+    Write the rows to `path` as Parquet (.parquet) or as an uncompressed Arrow
+    IPC file (any other extension, e.g. .arrow or .feather). The file is
+    written next to `path` and renamed into place. Returns the row count.
+    """
+    table = rows_to_table(rows)
+    tmp_path = f"{path}.tmp"
+    if path.endswith(".parquet"):
+        pq.write_table(table, tmp_path)
+    else:
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return table.num_rows
+
+def read_changeset(path):
+    """
+    Read an exported change set as an Arrow table. Arrow IPC files are
+    memory-mapped, so the columns point straight into the file without copying.
+    """
+    if path.endswith(".parquet"):
+        return pq.read_table(path, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+def write_csv(table, buffer):
+    """Write an Arrow table as header-less CSV (nulls as empty fields) for COPY ... FROM STDIN."""
+    pyarrow.csv.write_csv(table, buffer, pyarrow.csv.WriteOptions(include_header=False))
@@ -0,0 +1,268 @@
+import json
+import random
+import signal
+import logging
+import argparse
+import threading
+from collections import Counter, defaultdict
+from contextlib import closing
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gsheetfetch
+import migrationtopsql
+from diffengine import find_missing_serials_in_postgres
+from instrumentation import setup_logging, metrics
+
+# Seconds between polls of the sheet when the last cycle succeeded
+POLL_INTERVAL = 60
+
+# Each wait is randomised by +/- this fraction so several daemons do not poll in step
+POLL_JITTER = 0.2
+
+# Upper bound (seconds) of the exponential backoff after failed cycles
+MAX_BACKOFF = 900
+
+# Local port of the /health and /metrics endpoint
+HEALTH_PORT = 8765
+
+# /health reports unhealthy after this many failed cycles in a row
+UNHEALTHY_AFTER_FAILURES = 3
+
+# PostgreSQL connections kept open between cycles
+POOL_SIZE = 2
+
+def jittered(seconds, jitter=POLL_JITTER):
+    """Randomise a delay by +/- `jitter` (a fraction of the delay)."""
+    return seconds * random.uniform(1 - jitter, 1 + jitter)
+
+class SyncDaemon:
+    """
+    Long-running fetch -> diff -> push loop.
+
+    The Sheets and Drive services, the credentials and a PostgreSQL connection
+    pool stay open between cycles. A cycle only downloads sheets whose Drive
+    revision changed, only checks the rows of pages whose block hash changed
+    since the last successful cycle against PostgreSQL, and inserts the
+    missing ones.
+    """
+
+    def __init__(self, sources=gsheetfetch.SHEET_SOURCES, interval=POLL_INTERVAL, method="copy", pool_size=POOL_SIZE):
+        self.sources = sources
+        self.interval = interval
+        self.method = method
+        self.pool_size = pool_size
+        self.stop_event = threading.Event()
+        self.block_hashes = {}
+        self.revisions = {}
+        self.creds = None
+        self.service = None
+        self.drive = None
+        self.pool = None
+        self.postgres_columns = None
+        self._lock = threading.Lock()
+        self.state = {
+            "started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "cycles": 0,
+            "consecutive_failures": 0,
+            "last_success": None,
+            "last_error": None,
+            "last_inserted": 0,
+            "known_blocks": 0,
+        }
+
+    def start(self):
+        """Authenticate, build the Sheets and Drive services and open the PostgreSQL pool."""
+        self.creds = gsheetfetch.authenticate()
+        self.service = gsheetfetch.get_sheets_service(self.creds)
+        self.drive = gsheetfetch.get_drive_service(self.creds)
+        self.pool = migrationtopsql.create_connection_pool(self.pool_size)
+        conn = self.pool.getconn()
+        try:
+            self.postgres_columns = migrationtopsql.get_postgres_table_columns(conn)
+        finally:
+            self.pool.putconn(conn)
+
+    def stop(self):
+        """Ask the loop to finish after the current cycle."""
+        self.stop_event.set()
+
+    def close(self):
+        """Close the PostgreSQL connection pool."""
+        if self.pool is not None:
+            self.pool.closeall()
+
+    def changed_sources(self):
+        """Return [(source, revision)] for the sources edited since the last successful cycle."""
+        changed = []
+        for sheet_id, range_name in self.sources:
+            revision = gsheetfetch.get_sheet_revision(self.creds, sheet_id, drive=self.drive)
+            if revision is None or revision != self.revisions.get((sheet_id, range_name)):
+                changed.append(((sheet_id, range_name), revision))
+        return changed
+
+    def fetch_changed_rows(self, sources):
+        """
+        Fetch the sources and return the (serial_number, manufacture_date) rows
+        of the pages whose block hash differs from the last successful cycle,
+        together with the block hashes of all fetched pages. Rows are merged
+        per source in `sources` order, so a later source wins whatever order
+        the pages arrive in.
+        """
+        rows_by_source = defaultdict(dict)
+        hashes = {}
+        date_failures = Counter()
+        with closing(gsheetfetch.fetch_sources(self.service, self.creds, sources)) as pages:
+            for source, block, page in pages:
+                digest = gsheetfetch.block_hash(page)
+                hashes[(source, block)] = digest
+                data_rows = page[1:] if block == 0 else page  # Skip the header row
+                metrics.incr("rows_fetched", len(data_rows))
+                if self.block_hashes.get((source, block)) == digest:
+                    continue
+                metrics.incr("rows_parsed", len(data_rows))
+                for serial_number, manufacture_date in gsheetfetch.transform_rows(data_rows, date_failures):
+                    if serial_number != "NULL":
+                        rows_by_source[source][serial_number] = manufacture_date
+        gsheetfetch.log_date_failures(date_failures)
+        metrics.incr("date_failures", sum(date_failures.values()))
+        return list(gsheetfetch.merge_sources(rows_by_source, sources).items()), hashes
+
+    def _push_missing(self, rows):
+        """Check the candidate rows against PostgreSQL and insert the missing ones on a pooled connection."""
+        conn = self.pool.getconn()
+        try:
+            missing_serials = find_missing_serials_in_postgres(
+                conn, [serial_number for serial_number, _ in rows], migrationtopsql.POSTGRES_TABLE
+            )
+            missing_rows = [row for row in rows if row[0] in missing_serials]
+            metrics.incr("rows_missing", len(missing_rows))
+            inserted_count = 0
+            if missing_rows:
+                inserted_count = migrationtopsql.insert_data_into_postgres(
+                    conn, missing_rows, self.postgres_columns, method=self.method
+                )
+        except Exception as e:
+            self.pool.putconn(conn, close=isinstance(e, migrationtopsql.psycopg2.Error))
+            raise
+        self.pool.putconn(conn)
+        return inserted_count
+
+    def run_cycle(self):
+        """Run one incremental fetch -> diff -> push cycle and return the inserted count."""
+        self.creds = gsheetfetch.authenticate()  # Cached in process; refreshed before it expires
+        changed = self.changed_sources()
+        if not changed:
+            logging.debug("No sheet changed since the last cycle.")
+            return 0
+
+        sources = [source for source, _ in changed]
+        with metrics.stage("fetch"):
+            candidates, hashes = self.fetch_changed_rows(sources)
+
+        inserted_count = 0
+        if candidates:
+            with metrics.stage("push"):
+                inserted_count = self._push_missing(candidates)
+
+        # Replace the block hashes of the fetched sources, dropping blocks past their new end
+        fetched = {gsheetfetch.source_key(sheet_id, range_name) for sheet_id, range_name in sources}
+        self.block_hashes = {key: digest for key, digest in self.block_hashes.items() if key[0] not in fetched}
+        self.block_hashes.update(hashes)
+        for source, revision in changed:
+            self.revisions[source] = revision
+        logging.info(f"Cycle finished: {len(candidates)} serial numbers from changed pages checked, {inserted_count} inserted.")
+        return inserted_count
+
+    def run(self):
+        """Poll until stopped, backing off exponentially (with jitter) after failed cycles."""
+        while not self.stop_event.is_set():
+            try:
+                inserted_count = self.run_cycle()
+                with self._lock:
+                    self.state["consecutive_failures"] = 0
+                    self.state["last_success"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    self.state["last_inserted"] = inserted_count
+                delay = self.interval
+            except Exception as e:
+                logging.error(f"❌ Sync cycle failed: {e}")
+                with self._lock:
+                    self.state["consecutive_failures"] += 1
+                    self.state["last_error"] = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: {e}"
+                    delay = min(MAX_BACKOFF, self.interval * 2 ** self.state["consecutive_failures"])
+            with self._lock:
+                self.state["cycles"] += 1
+                self.state["known_blocks"] = len(self.block_hashes)
+            metrics.write("daemon")
+            self.stop_event.wait(jittered(delay))
+
+    def health(self):
+        """Return the daemon state with an overall "ok" / "failing" status."""
+        with self._lock:
+            health = dict(self.state)
+        failing = health["consecutive_failures"] >= UNHEALTHY_AFTER_FAILURES
+        health["status"] = "failing" if failing else "ok"
+        return health
+
+def make_health_handler(daemon):
+    """Return a request handler serving GET /health and GET /metrics as JSON."""
+
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/health":
+                body = daemon.health()
+                status = 200 if body["status"] == "ok" else 503
+            elif self.path == "/metrics":
+                body = {**metrics.snapshot(), "daemon": daemon.health()}
+                status = 200
+            else:
+                body = {"error": "not found"}
+                status = 404
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logging.debug(f"Health endpoint: {format % args}")
+
+    return HealthHandler
+
+def start_health_server(daemon, port=HEALTH_PORT):
+    """Serve the health endpoint on localhost from a background thread."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_health_handler(daemon))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Health endpoint listening on http://127.0.0.1:{port}/health")
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep PostgreSQL in sync with the sheet by polling it continuously.")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help=f"seconds between polls (default: {POLL_INTERVAL})")
+    parser.add_argument("--port", type=int, default=HEALTH_PORT, help=f"local health/metrics port (default: {HEALTH_PORT})")
+    parser.add_argument(
+        "--method", choices=["copy", "values", "row"], default="copy",
+        help="PostgreSQL bulk-load strategy (default: copy)"
+    )
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE, help=f"PostgreSQL connections to keep open (default: {POOL_SIZE})")
+    args = parser.parse_args()
+    # Configure logging to both file and console
+    setup_logging("daemon.log")
+
+    daemon = SyncDaemon(interval=args.interval, method=args.method, pool_size=args.pool_size)
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    signal.signal(signal.SIGINT, lambda *_: daemon.stop())
+
+    server = start_health_server(daemon, args.port)
+    try:
+        daemon.start()
+        logging.info(f"Sync daemon started; polling every {args.interval:.0f}s.")
+        daemon.run()
+    finally:
+        server.shutdown()
+        daemon.close()
+        logging.info("Sync daemon stopped.")
+
+if __name__ == "__main__":
+    main()
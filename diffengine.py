@@ -0,0 +1,325 @@
+import os
+import sqlite3
+import logging
+import argparse
+from datetime import date, datetime
+from instrumentation import metrics
+from bootstrap import lazy_import
+from manifest import table_hash, file_signature, combine_hashes, stage_unchanged, record_stage
+from migrationtopsql import connect_to_postgres, POSTGRES_TABLE
+from storage import (
+    open_db, ensure_missing_table, upsert_missing_rows, prune_missing_rows, count_duplicates, log_duplicates
+)
+
+# Only needed by the live (PostgreSQL) diff
+sql = lazy_import("psycopg2.sql")
+
+LOCAL_DB = "local_data.db"
+PROCESSED_DB = "processed_data.db"
+MISSING_DB = "missing_data.db"
+
+# Table created in missing_data.db when there is no local_data.db to copy the structure from
+MISSING_TABLE = "cookstoves_local"
+
+def ensure_serial_index(conn, table_name, column="serial_number", schema="main"):
+    """Create an index on the serial column of the given table if none exists."""
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA {schema}.index_list({table_name})")
+    for index in cursor.fetchall():
+        cursor.execute(f"PRAGMA {schema}.index_info({index[1]})")
+        index_columns = [row[2] for row in cursor.fetchall()]
+        if index_columns and index_columns[0] == column:
+            return False
+
+    index_name = f"idx_{table_name}_{column}"
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.{index_name} ON {table_name} ({column})")
+    conn.commit()
+    logging.info(f"✅ Created index {index_name} on {table_name}({column}).")
+    return True
+
+def find_missing_rows(processed_db, processed_table, local_db, local_table):
+    """
+    Return the (serial_number, manufacture_date) rows of the processed table
+    whose serial number does not exist in the local table.
+
+    Both databases are opened on one connection (local_data is ATTACHed) and
+    the missing set is computed with a single anti-join instead of one
+    lookup per serial number.
+    """
+    with open_db(processed_db) as conn:
+        conn.execute("ATTACH DATABASE ? AS local", (local_db,))
+        try:
+            ensure_serial_index(conn, local_table, schema="local")
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT p.column_a, p.column_c
+                FROM main.{processed_table} AS p
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM local.{local_table} AS l
+                    WHERE l.serial_number = p.column_a
+                )
+            """)
+            missing_rows = cursor.fetchall()
+            metrics.incr("rows_missing", len(missing_rows))
+            return missing_rows
+        finally:
+            conn.execute("DETACH DATABASE local")
+
+def diff_input_hash(processed_db, processed_table, local_db, missing_db, missing_table):
+    """
+    Hash everything a diff run against local_data.db depends on: the processed
+    table, the local_data.db file (size and mtime) and the current missing
+    set, which a successful run leaves unchanged on a rerun.
+    """
+    with sqlite3.connect(processed_db) as conn:
+        processed = table_hash(conn, processed_table, ["column_a", "column_c"], "column_a")
+    missing = "absent"
+    if os.path.exists(missing_db):
+        with sqlite3.connect(missing_db) as conn:
+            missing = table_hash(conn, missing_table, ["serial_number", "manufacture_date"], "serial_number")
+    return combine_hashes(processed, file_signature(local_db), missing)
+
+def store_missing_rows(missing_db, table_name, rows):
+    """
+    Make the missing_data.db table hold exactly the current missing
+    (serial_number, manufacture_date) rows: they are upserted keyed on
+    serial_number and rows no longer missing (e.g. already pushed) are deleted.
+    """
+    log_duplicates(count_duplicates(row[0] for row in rows), "the missing rows")
+    with open_db(missing_db) as conn:
+        ensure_missing_table(conn, table_name)
+        upsert_missing_rows(conn, table_name, rows)
+        prune_missing_rows(conn, table_name, (row[0] for row in rows))
+        conn.commit()
+    return len(rows)
+
+def export_missing_rows(rows, path):
+    """
+    Write the missing rows as an Arrow IPC/Feather or Parquet change set
+    (see changeset.py), for migrationtopsql.py --from-arrow and for analytics.
+    """
+    from changeset import write_changeset
+    row_count = write_changeset(rows, path)
+    logging.info(f"✅ Exported {row_count} missing rows to {path}.")
+    return row_count
+
+def export_stored_missing_rows(missing_db, table_name, path):
+    """
+    Export the rows stored in missing_data.db, for runs whose diff was skipped
+    because its inputs were unchanged.
+    """
+    with sqlite3.connect(missing_db) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT serial_number, manufacture_date FROM {table_name} ORDER BY serial_number")
+        rows = cursor.fetchall()
+    return export_missing_rows(rows, path)
+
+def find_missing_in_batch(serial_numbers, manufacture_dates, serial_index):
+    """
+    Return the (serial_number, manufacture_date) rows of a columnar batch whose
+    serial number is not in serial_index (a SerialIndex), checked in one
+    vectorised call for the whole batch.
+    """
+    present = serial_index.contains(serial_numbers)
+    missing_rows = [
+        (serial_number, manufacture_date)
+        for serial_number, manufacture_date, known in zip(serial_numbers, manufacture_dates, present)
+        if not known
+    ]
+    metrics.incr("rows_missing", len(missing_rows))
+    return missing_rows
+
+def find_missing_serials_in_postgres(pg_conn, serial_numbers, pg_table="cookstoves"):
+    """
+    Return the set of serial numbers that do not exist in the PostgreSQL table.
+    All candidates are sent as one text[] parameter and checked with a single
+    NOT EXISTS query against the live table.
+    """
+    cursor = pg_conn.cursor()
+    cursor.execute(sql.SQL("""
+        SELECT candidate.serial_number
+        FROM unnest(%s::text[]) AS candidate(serial_number)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {} AS existing
+            WHERE existing.serial_number = candidate.serial_number
+        )
+    """).format(sql.Identifier(pg_table)), (list(serial_numbers),))
+    missing_serials = {row[0] for row in cursor.fetchall()}
+    pg_conn.rollback()
+    return missing_serials
+
+def find_missing_rows_in_postgres(processed_db, processed_table, pg_conn, pg_table="cookstoves"):
+    """
+    Return the (serial_number, manufacture_date) rows of the processed table
+    whose serial number does not exist in the live PostgreSQL table.
+    """
+    with open_db(processed_db) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT column_a, column_c FROM {processed_table}")
+        processed_rows = cursor.fetchall()
+    missing_serials = find_missing_serials_in_postgres(pg_conn, (row[0] for row in processed_rows), pg_table)
+    missing_rows = [row for row in processed_rows if row[0] in missing_serials]
+    metrics.incr("rows_missing", len(missing_rows))
+    return missing_rows
+
+def normalize_manufacture_date(value):
+    """Normalise a manufacture date from either side to 'YYYY-MM-DD HH:MM:SS' text, or None."""
+    if value is None or value == "NULL":
+        return None
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d 00:00:00")
+    return str(value)
+
+def _distinct_sorted(rows, side):
+    """Yield the first row of each serial number, checking the rows are sorted by serial number."""
+    previous = None
+    for row in rows:
+        if previous is not None and row[0] <= previous:
+            if row[0] == previous:
+                continue
+            raise ValueError(f"Rows from {side} are not sorted by serial number ({row[0]!r} after {previous!r}).")
+        previous = row[0]
+        yield row
+
+def reconcile_sorted(sheet_rows, db_rows):
+    """
+    Compare two streams of (serial_number, manufacture_date) rows, each sorted
+    by serial number, in one merge pass. Yields (kind, serial_number,
+    sheet_date, db_date) where kind is "only_in_sheet", "only_in_db" or
+    "different" (present on both sides with another manufacture date).
+    """
+    sheet_iter = _distinct_sorted(sheet_rows, "the sheet")
+    db_iter = _distinct_sorted(db_rows, "the database")
+    sheet_row = next(sheet_iter, None)
+    db_row = next(db_iter, None)
+    while sheet_row is not None or db_row is not None:
+        if db_row is None or (sheet_row is not None and sheet_row[0] < db_row[0]):
+            yield "only_in_sheet", sheet_row[0], normalize_manufacture_date(sheet_row[1]), None
+            sheet_row = next(sheet_iter, None)
+        elif sheet_row is None or db_row[0] < sheet_row[0]:
+            yield "only_in_db", db_row[0], None, normalize_manufacture_date(db_row[1])
+            db_row = next(db_iter, None)
+        else:
+            sheet_date = normalize_manufacture_date(sheet_row[1])
+            db_date = normalize_manufacture_date(db_row[1])
+            if sheet_date != db_date:
+                yield "different", sheet_row[0], sheet_date, db_date
+            sheet_row = next(sheet_iter, None)
+            db_row = next(db_iter, None)
+
+def get_table_name(db_path):
+    """Retrieve the first table name from the given database."""
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' LIMIT 1")
+        table = cursor.fetchone()
+        return table[0] if table else None
+
+def create_missing_db_structure(source_db, missing_db, table_name):
+    """Creates a new database with the same structure as the given table."""
+    with sqlite3.connect(source_db) as src_conn, sqlite3.connect(missing_db) as dest_conn:
+        src_cursor = src_conn.cursor()
+        dest_cursor = dest_conn.cursor()
+
+        # Get table structure from source database
+        src_cursor.execute(f"SELECT sql FROM sqlite_master WHERE type='table' AND name='{table_name}'")
+        table_structure = src_cursor.fetchone()
+
+        if table_structure and table_structure[0]:
+            dest_cursor.execute(table_structure[0])
+            logging.info(f"✅ Created {missing_db} with the same table structure as {table_name}.")
+        else:
+            logging.error(f"❌ Could not retrieve table structure from {table_name}.")
+
+def create_missing_table(missing_db, table_name=MISSING_TABLE):
+    """Create a minimal missing_data.db table holding only the columns the pipeline writes."""
+    with sqlite3.connect(missing_db) as conn:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} (serial_number TEXT, manufacture_date TEXT)")
+        conn.commit()
+
+def run_diff(live=False, force=False, export_path=None, run_name="diff", verbose=False):
+    """
+    Store the processed rows missing from local_data.db in missing_data.db.
+    With live=True the rows are checked directly against the PostgreSQL
+    table instead, and local_data.db is not needed. A local run is skipped
+    when its inputs match the last successful run, unless force is set; live
+    runs always run, since the PostgreSQL table can change at any time.
+    With export_path the missing rows are also written as an Arrow IPC
+    (.arrow/.feather) or Parquet (.parquet) file, taken from missing_data.db
+    when the run is skipped.
+    Each step is logged at INFO with verbose (compare.py) and at DEBUG
+    otherwise (dbfetch.py); the run's metrics are stored under run_name.
+    """
+    progress = logging.info if verbose else logging.debug
+
+    # Get actual table names
+    processed_table = get_table_name(PROCESSED_DB)
+    if live:
+        local_table = get_table_name(MISSING_DB) if os.path.exists(MISSING_DB) else MISSING_TABLE
+    else:
+        local_table = get_table_name(LOCAL_DB)
+
+    if not local_table or not processed_table:
+        logging.error("❌ Could not determine table names from one or both databases.")
+        return
+
+    progress(f"✅ Found tables: {local_table} (local_data) and {processed_table} (processed_data)")
+
+    # Ensure missing_data.db exists
+    if not os.path.exists(MISSING_DB):
+        progress(f"🔧 Creating {MISSING_DB}...")
+        if live:
+            create_missing_table(MISSING_DB, local_table)
+        else:
+            create_missing_db_structure(LOCAL_DB, MISSING_DB, local_table)
+
+    try:
+        input_hash = None if live else diff_input_hash(PROCESSED_DB, processed_table, LOCAL_DB, MISSING_DB, local_table)
+        if input_hash and not force and stage_unchanged("diff", input_hash):
+            if export_path:
+                export_stored_missing_rows(MISSING_DB, local_table, export_path)
+            return
+
+        with metrics.stage("diff"):
+            if live:
+                progress(f"🔍 Checking {processed_table} serial numbers against PostgreSQL table '{POSTGRES_TABLE}'...")
+                pg_conn = connect_to_postgres()
+                try:
+                    missing_rows = find_missing_rows_in_postgres(PROCESSED_DB, processed_table, pg_conn, POSTGRES_TABLE)
+                finally:
+                    pg_conn.close()
+            else:
+                progress(f"🔍 Computing missing serial numbers ({processed_table} anti-join {local_table})...")
+                missing_rows = find_missing_rows(PROCESSED_DB, processed_table, LOCAL_DB, local_table)
+        progress(f"✅ Found {len(missing_rows)} missing serial numbers.")
+
+        # Replace the missing set in missing_data.db
+        store_missing_rows(MISSING_DB, local_table, missing_rows)
+        if missing_rows:
+            logging.info(f"✅ Added {len(missing_rows)} missing entries to {MISSING_DB}.")
+        else:
+            logging.info("✅ No missing entries found.")
+        if export_path:
+            export_missing_rows(missing_rows, export_path)
+        if not live:
+            record_stage("diff", diff_input_hash(PROCESSED_DB, processed_table, LOCAL_DB, MISSING_DB, local_table))
+    except sqlite3.Error as e:
+        logging.error(f"❌ SQLite error occurred: {e}")
+    finally:
+        metrics.write(run_name)
+
+def diff_arg_parser():
+    """Return the command-line parser shared by compare.py and dbfetch.py."""
+    parser = argparse.ArgumentParser(description="Find processed rows missing from the cookstoves data.")
+    parser.add_argument(
+        "--live", action="store_true",
+        help="diff against the PostgreSQL table instead of the local_data.db snapshot"
+    )
+    parser.add_argument("--force", action="store_true", help="run even if the inputs are unchanged since the last run")
+    parser.add_argument(
+        "--export", metavar="PATH",
+        help="also write the missing rows to PATH as Arrow IPC (.arrow/.feather) or Parquet (.parquet)"
+    )
+    return parser
@@ -1,124 +1,487 @@
 import os
 import logging
-import sqlite3
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+import hashlib
+import json
+import argparse
+import time
+import queue
+import random
+import threading
+from collections import Counter
+from functools import lru_cache
+from contextlib import closing
 from datetime import datetime
+from instrumentation import setup_logging, metrics
+from bootstrap import lazy_import, get_credentials, build_service
+from storage import (
+    open_db, ensure_clean_record, upsert_processed_rows, delete_block_rows, count_untagged_rows, log_duplicates
+)
+
+# Imported on first use, so importing this module stays cheap
+httplib2 = lazy_import("httplib2")
+google_auth_httplib2 = lazy_import("google_auth_httplib2")
+googleapiclient_errors = lazy_import("googleapiclient.errors")
 
 # Define Google Drive API scope
 SCOPES = ['https://www.googleapis.com/auth/drive',
           'https://www.googleapis.com/auth/spreadsheets']
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler("script.log"), logging.StreamHandler()]
-)
+# Google Sheet ID and range
+SHEET_ID = "15LuTTWYN_ETK0srFueuqXAbrRy53QhKr5x3F5zov08Y"
+RANGE_NAME = "Clean Record!A2:C"  # Start from row 2, include columns A and C
+
+# (sheet ID, range) sources merged into processed_data.db; add regional sheets here
+SHEET_SOURCES = [
+    (SHEET_ID, RANGE_NAME),
+]
+
+# Maximum number of sources fetched at the same time
+MAX_CONCURRENT_FETCHES = 4
+
+# Retries (with exponential backoff) for quota and transient server errors
+FETCH_RETRIES = 5
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Number of sheet rows requested per page; each page is also one sync block
+PAGE_SIZE = 10000
+
+# Seconds a fetch worker waits on the full page queue before checking whether the consumer stopped
+QUEUE_PUT_TIMEOUT = 1
+
+# Number of pages requested together in one values.batchGet call
+PAGES_PER_REQUEST = 3
+
+# Accepted column C date formats, tried in order (day-first formats win for ambiguous dates)
+DATE_FORMATS = ["%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%d/%m/%y", "%m/%d/%Y"]
 
 # Authenticate with Google APIs
 def authenticate():
-    """Authenticate with Google APIs."""
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json')
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            script_dir = os.path.dirname(os.path.realpath(__file__))
-            credentials_path = os.path.join(script_dir, 'credentials.json')
-            flow = InstalledAppFlow.from_client_secrets_file(credentials_path, SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
+    """
+    Authenticate with Google APIs.
+    Credentials are cached in process and refreshed before they expire (see bootstrap.get_credentials).
+    """
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    creds = get_credentials(SCOPES, os.path.join(script_dir, 'credentials.json'))
     logging.info("Authentication successful.")
     return creds
 
 # Function to fetch data from Google Sheets
-def fetch_google_sheet_data(sheet_id, range_name):
+def fetch_google_sheet_data(sheet_id, range_name, creds=None):
     """Fetch data from a specific range in a Google Sheet."""
-    creds = authenticate()
-    service = build('sheets', 'v4', credentials=creds)
+    creds = creds or authenticate()
+    service = build_service('sheets', 'v4', creds)
     result = service.spreadsheets().values().get(spreadsheetId=sheet_id, range=range_name).execute()
     values = result.get('values', [])
     logging.info(f"Fetched {len(values)} rows from range '{range_name}' in Google Sheet.")
     return values
 
-# Function to process and transform data
+def get_sheets_service(creds=None):
+    """Build a Google Sheets API service object from the cached discovery document."""
+    return build_service('sheets', 'v4', creds or authenticate())
+
+def get_drive_service(creds=None):
+    """Build a Google Drive API service object from the cached discovery document."""
+    return build_service('drive', 'v3', creds or authenticate())
+
+def parse_range(range_name):
+    """Split an A1 range such as 'Clean Record!A2:C' into (sheet, first_col, first_row, last_col)."""
+    sheet_name, cells = range_name.rsplit('!', 1)
+    start, end = cells.split(':')
+    first_col = start.rstrip('0123456789')
+    first_row = int(start[len(first_col):] or 1)
+    last_col = end.rstrip('0123456789')
+    return sheet_name, first_col, first_row, last_col
+
+def source_key(sheet_id, range_name):
+    """Return the key used for a (sheet ID, range) source in the sync tables."""
+    return f"{sheet_id}!{range_name}"
+
+def merge_sources(rows_by_source, sources, duplicates=None):
+    """
+    Merge per-source {serial number: manufacture date} dicts in `sources`
+    order, so a later source replaces an earlier one for the same serial
+    number whichever source's pages arrived last. Serial numbers found in
+    more than one source are counted in `duplicates`.
+    """
+    merged = {}
+    for sheet_id, range_name in sources:
+        for serial_number, manufacture_date in rows_by_source.pop(source_key(sheet_id, range_name), {}).items():
+            if duplicates is not None and serial_number in merged:
+                duplicates[serial_number] += 1
+            merged[serial_number] = manufacture_date
+    return merged
+
+def execute_with_backoff(request, http=None, retries=FETCH_RETRIES):
+    """Execute an API request, retrying quota and transient errors with exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return request.execute(http=http)
+        except googleapiclient_errors.HttpError as e:
+            if e.resp.status not in RETRYABLE_STATUSES or attempt == retries:
+                raise
+            delay = min(60, 2 ** attempt) + random.uniform(0, 1)
+            logging.warning(f"Google API returned {e.resp.status}; retrying in {delay:.1f}s (attempt {attempt + 1}/{retries}).")
+            time.sleep(delay)
+
+def iter_sheet_pages(service, sheet_id, range_name, page_size=PAGE_SIZE, http=None):
+    """
+    Yield the rows of an open-ended range one page at a time.
+    Fixed-size row windows (e.g. A2:C10001, then A10002:C20001) are requested
+    PAGES_PER_REQUEST at a time with values.batchGet until a window comes back empty.
+    """
+    sheet_name, first_col, first_row, last_col = parse_range(range_name)
+    start = first_row
+    while True:
+        windows = [
+            f"{sheet_name}!{first_col}{row}:{last_col}{row + page_size - 1}"
+            for row in range(start, start + page_size * PAGES_PER_REQUEST, page_size)
+        ]
+        request = service.spreadsheets().values().batchGet(spreadsheetId=sheet_id, ranges=windows)
+        result = execute_with_backoff(request, http)
+        value_ranges = result.get('valueRanges', [])
+        for window, value_range in zip(windows, value_ranges):
+            rows = value_range.get('values', [])
+            if not rows:
+                return
+            logging.info(f"Fetched {len(rows)} rows from range '{window}' in Google Sheet.")
+            yield rows
+        if len(value_ranges) < len(windows):
+            return
+        start += page_size * PAGES_PER_REQUEST
+
+def _drain(items):
+    """Yield items put on the queue as (True, item) until a (False, error-or-None) marker."""
+    while True:
+        has_item, value = items.get()
+        if not has_item:
+            if value is not None:
+                raise value
+            return
+        yield value
+
+def fetch_sources(service, creds, sources, max_workers=MAX_CONCURRENT_FETCHES, depth=4):
+    """
+    Fetch several (sheet ID, range) sources concurrently with one shared service object.
+    Yields (source key, block, rows) as pages arrive; pages of one source keep
+    their order. Each worker thread uses its own authorized HTTP connection,
+    since httplib2 connections are not thread-safe. If the consumer stops early
+    (or raises), the workers stop at their next page and no further source is
+    started. The workers are daemon threads, so a consumer that exits without
+    closing the generator does not keep the process alive.
+    """
+    items = queue.Queue(maxsize=depth)
+    pending = queue.Queue()
+    for source in sources:
+        pending.put(source)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        """Queue an item, giving up (and returning False) once the consumer has stopped."""
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=QUEUE_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch_one(sheet_id, range_name):
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
+        key = source_key(sheet_id, range_name)
+        try:
+            for block, rows in enumerate(iter_sheet_pages(service, sheet_id, range_name, http=http)):
+                if errors or not put((True, (key, block, rows))):
+                    return
+        finally:
+            http.close()
+
+    def worker():
+        while not stop.is_set() and not errors:
+            try:
+                sheet_id, range_name = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                fetch_one(sheet_id, range_name)
+            except Exception as e:
+                errors.append(e)
+
+    def fetch_all():
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(min(max_workers, len(sources)))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        put((False, errors[0] if errors else None))
+
+    def consume():
+        try:
+            yield from _drain(items)
+        finally:
+            stop.set()
+
+    threading.Thread(target=fetch_all, daemon=True).start()
+    return consume()
+
+# Functions to process and transform data
+@lru_cache(maxsize=65536)
+def parse_date(raw):
+    """Convert a raw date string to yyyy-mm-dd hh:mm:ss, or None if no format matches."""
+    value = raw.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+    return None
+
+def normalize_dates(values, failures=None):
+    """
+    Normalize a whole column of raw date strings at once.
+    Each distinct raw value is parsed only once (see parse_date); empty values
+    become None. Unparseable values are counted in `failures` instead of
+    being logged one by one.
+    """
+    failures = failures if failures is not None else Counter()
+    dates = []
+    for raw in values:
+        date = parse_date(raw) if raw else None
+        if raw and date is None:
+            failures[raw] += 1
+        dates.append(date)
+    return dates, failures
+
+def log_date_failures(failures):
+    """Log a single summary line for the column C values that could not be parsed."""
+    if failures:
+        examples = ", ".join(value for value, _ in failures.most_common(5))
+        logging.warning(
+            f"{sum(failures.values())} rows ({len(failures)} distinct values) have an unrecognised "
+            f"date format in column C, e.g. {examples}"
+        )
+
+def transform_rows(rows, failures=None):
+    """
+    Yield the processed [column_a, column_c] row for each raw sheet row.
+    Dates for the whole batch are normalized in one pass before rows are yielded.
+    """
+    col_a = [row[0] if len(row) > 0 and row[0].strip() else None for row in rows]  # Column A
+    col_c = [row[2] if len(row) > 2 and row[2].strip() else None for row in rows]  # Column C
+
+    # Convert dates in column C to yyyy-mm-dd hh:mm:ss
+    dates, _ = normalize_dates(col_c, failures)
+
+    # Yield processed rows, replacing None with "NULL" for SQL compatibility
+    for serial_number, formatted_date in zip(col_a, dates):
+        yield [serial_number if serial_number else "NULL", formatted_date if formatted_date else "NULL"]
+
 def process_data(data):
     """
     Process the fetched data:
     - Skip the header row.
     - Extract columns A and C.
-    - Convert column C dates from dd/mm/yyyy to yyyy-mm-dd hh:mm:ss.
+    - Convert column C dates (dd/mm/yyyy, dd-mm-yyyy, ISO and others in
+      DATE_FORMATS) to yyyy-mm-dd hh:mm:ss.
     - Replace empty or missing values with NULL.
     """
-    processed_data = []
-    for row in data[1:]:  # Skip the header row
-        col_a = row[0] if len(row) > 0 and row[0].strip() else None  # Column A
-        col_c = row[2] if len(row) > 2 and row[2].strip() else None  # Column C
-        
-        # Convert date in column C to yyyy-mm-dd hh:mm:ss
-        if col_c:
-            try:
-                date_obj = datetime.strptime(col_c, "%d/%m/%Y")
-                formatted_date = date_obj.strftime("%Y-%m-%d %H:%M:%S")
-            except ValueError:
-                logging.warning(f"Invalid date format in column C: {col_c}")
-                formatted_date = None
-        else:
-            formatted_date = None
-        
-        # Append processed row, replacing None with "NULL" for SQL compatibility
-        processed_data.append([col_a if col_a else "NULL", formatted_date if formatted_date else "NULL"])
-    
+    failures = Counter()
+    processed_data = list(transform_rows(data[1:], failures))  # Skip the header row
+    log_date_failures(failures)
     logging.info(f"Processed {len(processed_data)} rows.")
     return processed_data
 
+# Function to read the sheet's Drive revision
+def get_sheet_revision(creds, sheet_id, drive=None):
+    """
+    Return the Drive version number of the spreadsheet.
+    The version changes on every edit, so an unchanged version means the
+    sheet content is unchanged. Pass `drive` to reuse a Drive service across
+    calls. Returns None if the Drive API is unavailable.
+    """
+    try:
+        drive = drive or get_drive_service(creds)
+        result = drive.files().get(fileId=sheet_id, fields='version').execute()
+        return result.get('version')
+    except Exception as e:
+        logging.warning(f"Could not read Drive revision for sheet {sheet_id}: {e}")
+        return None
+
+# Functions to manage the processed data store and its sync cursor
+def ensure_sync_tables(conn):
+    """Create the clean_record table keyed on column_a and the sync cursor tables."""
+    ensure_clean_record(conn)
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_block (
+            source TEXT,
+            block INTEGER,
+            row_count INTEGER,
+            block_hash TEXT,
+            PRIMARY KEY (source, block)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_cursor (
+            source TEXT PRIMARY KEY,
+            revision TEXT,
+            row_count INTEGER,
+            synced_at TEXT
+        )
+    ''')
+    conn.commit()
+
+def load_sync_cursor(conn, source):
+    """Return the (revision, row_count) stored for a source, or (None, 0)."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT revision, row_count FROM sync_cursor WHERE source = ?", (source,))
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (None, 0)
+
+def save_sync_cursor(conn, source, revision, row_count):
+    """Store the revision and row count reached by the last successful sync."""
+    conn.execute('''
+        INSERT INTO sync_cursor (source, revision, row_count, synced_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (source) DO UPDATE SET
+            revision = excluded.revision,
+            row_count = excluded.row_count,
+            synced_at = excluded.synced_at
+    ''', (source, revision, row_count, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+def block_hash(rows):
+    """Return a content hash for a block of raw sheet rows."""
+    return hashlib.sha1(json.dumps(rows, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def sync_pages(conn, sources, pages, full=False, precedence=None):
+    """
+    Write each page of raw sheet rows as it arrives, skipping pages whose
+    content hash matches the last sync. The rows a changed page held at the
+    last sync are deleted before its current rows are upserted, and the rows
+    of blocks past the end of a source are deleted once it has been read, so
+    rows removed or re-keyed in the sheet do not linger. With full, the
+    clean_record table is rebuilt from scratch.
+    `pages` yields (source key, block, rows) and the first row of block 0 of
+    each source is the header. Each page is committed on its own, so memory
+    use is bounded by the page size.
+    A serial number found in several sources keeps the row of the source
+    latest in `precedence` (all source keys in SHEET_SOURCES order, defaulting
+    to `sources`), and within a source the row of its latest block, whatever
+    order the pages arrive in.
+    Returns a dict of row and block counts per source key.
+    """
+    cursor = conn.cursor()
+    if full:
+        # Committed together with the first page
+        cursor.execute("DELETE FROM clean_record")
+        cursor.execute("DELETE FROM sync_block")
+    precedence = list(precedence or sources)
+    stored_hashes = {}
+    stats = {}
+    outranked_by = {}
+    for source in sources:
+        outranked_by[source] = precedence[precedence.index(source) + 1:] if source in precedence else []
+        cursor.execute("SELECT block, block_hash FROM sync_block WHERE source = ?", (source,))
+        stored_hashes[source] = dict(cursor.fetchall())
+        stats[source] = {"rows": 0, "written": 0, "no_serial": 0, "blocks": 0, "changed_blocks": 0}
+    date_failures = Counter()
+    duplicates = Counter()
+    seen_serials = set()
+
+    for source, block, page in pages:
+        source_stats = stats[source]
+        data_rows = page[1:] if block == 0 else page  # Skip the header row
+        source_stats["blocks"] += 1
+        source_stats["rows"] += len(data_rows)
+        metrics.incr("rows_fetched", len(data_rows))
+        digest = block_hash(page)
+        if not full and stored_hashes[source].get(block) == digest:
+            continue
+
+        processed = list(transform_rows(data_rows, date_failures))
+        delete_block_rows(conn, source, block, block)
+        written, no_serial = upsert_processed_rows(
+            conn, processed, duplicates, seen_serials, source, block, outranked_by[source]
+        )
+        metrics.incr("rows_parsed", len(processed))
+        source_stats["changed_blocks"] += 1
+        source_stats["written"] += written
+        source_stats["no_serial"] += no_serial
+        conn.execute('''
+            INSERT INTO sync_block (source, block, row_count, block_hash)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (source, block) DO UPDATE SET
+                row_count = excluded.row_count,
+                block_hash = excluded.block_hash
+        ''', (source, block, len(page), digest))
+        conn.commit()
+
+    for source, source_stats in stats.items():
+        conn.execute("DELETE FROM sync_block WHERE source = ? AND block >= ?", (source, source_stats["blocks"]))
+        removed = delete_block_rows(conn, source, source_stats["blocks"])
+        if removed:
+            logging.info(f"Removed {removed} rows of '{source}' past its last block.")
+        logging.info(
+            f"Synced {source_stats['written']} rows of '{source}' from {source_stats['changed_blocks']} changed blocks "
+            f"({source_stats['blocks'] - source_stats['changed_blocks']} of {source_stats['blocks']} blocks unchanged)."
+        )
+        if source_stats["no_serial"]:
+            logging.warning(f"Skipped {source_stats['no_serial']} rows of '{source}' without a serial number in column A.")
+    log_date_failures(date_failures)
+    log_duplicates(duplicates, "the changed sheet pages", "the latest source and block kept")
+    metrics.incr("date_failures", sum(date_failures.values()))
+    metrics.incr("duplicate_serials", len(duplicates))
+    return stats
+
 # Main function to execute the script
-def main():
+def main(full=False, sources=SHEET_SOURCES):
     try:
-        # Define Google Sheet ID and range
-        sheet_id = "15LuTTWYN_ETK0srFueuqXAbrRy53QhKr5x3F5zov08Y"
-        range_name = "Clean Record!A2:C"  # Start from row 2, include columns A and C
-        
-        # Fetch data from the Google Sheet
-        raw_data = fetch_google_sheet_data(sheet_id, range_name)
-        
-        # Process the data
-        processed_data = process_data(raw_data)
-        
-        # Print the processed data (for verification)
-        print("Processed Data:")
-        for row in processed_data:
-            print(row)
-        
-        # Optionally, save the processed data to an SQLite database
         db_name = "processed_data.db"
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-        logging.info(f"Created database: {db_name}")
-        
-        # Create a table to store the processed data
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS clean_record (
-                column_a TEXT,
-                column_c TEXT
+        conn = open_db(db_name)
+        ensure_sync_tables(conn)
+        logging.info(f"Opened database: {db_name}")
+
+        # Rows without a source block (older runs, pipeline.py checkpoints) can only be replaced by a rebuild
+        untagged = count_untagged_rows(conn)
+        if untagged and not full:
+            logging.info(f"{untagged} rows in 'clean_record' are not tagged with a sheet block; rebuilding the table.")
+            full = True
+
+        # Skip sources whose sheet has not been edited since the last sync
+        creds = authenticate()
+        to_sync = []
+        for sheet_id, range_name in sources:
+            source = source_key(sheet_id, range_name)
+            revision = get_sheet_revision(creds, sheet_id)
+            last_revision, last_row_count = load_sync_cursor(conn, source)
+            if not full and revision is not None and revision == last_revision:
+                logging.info(f"'{source}' unchanged since last sync (revision {revision}, {last_row_count} rows).")
+                continue
+            to_sync.append((sheet_id, range_name, revision))
+
+        if not to_sync:
+            logging.info("No sheet changed since the last sync. Nothing to do.")
+            conn.close()
+            return
+
+        # Stream all changed sources concurrently; pages are written as they arrive
+        service = get_sheets_service(creds)
+        pages = fetch_sources(service, creds, [(sheet_id, range_name) for sheet_id, range_name, _ in to_sync])
+
+        # Process and upsert only the pages that changed since the last sync
+        keys = [source_key(sheet_id, range_name) for sheet_id, range_name, _ in to_sync]
+        with metrics.stage("fetch"), closing(pages):
+            stats = sync_pages(
+                conn, keys, pages, full=full,
+                precedence=[source_key(sheet_id, range_name) for sheet_id, range_name in sources]
             )
-        ''')
-        logging.info("Created table 'clean_record' in database.")
-        
-        # Insert processed data into the table
-        cursor.executemany('''
-            INSERT INTO clean_record (column_a, column_c)
-            VALUES (?, ?)
-        ''', processed_data)
+        for key, (_, _, revision) in zip(keys, to_sync):
+            save_sync_cursor(conn, key, revision, stats[key]["rows"])
         conn.commit()
-        logging.info(f"Inserted {len(processed_data)} rows into table 'clean_record'.")
-        
+
+        written = sum(source_stats["written"] for source_stats in stats.values())
+        rows = sum(source_stats["rows"] for source_stats in stats.values())
+        logging.info(f"Upserted {written} of {rows} rows from {len(keys)} sources into table 'clean_record'.")
         conn.close()
         logging.info("Script execution completed successfully.")
         print("Script execution completed successfully. Check the log file for details.")
@@ -126,6 +489,13 @@ def main():
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         print(f"An error occurred: {e}")
+    finally:
+        metrics.write("gsheetfetch")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Configure logging to both file and console
+    setup_logging("script.log")
+    parser = argparse.ArgumentParser(description="Sync the Clean Record sheet into processed_data.db.")
+    parser.add_argument("--full", action="store_true", help="ignore the sync cursor and re-sync every block")
+    args = parser.parse_args()
+    main(full=args.full)
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# JSON file the per-run counters and stage timings are written to
+METRICS_FILE = "metrics.json"
+
+_listener = None
+
+def setup_logging(log_file, level=logging.INFO, console=True):
+    """
+    Configure the root logger to write to `log_file` (and the console) from a
+    background QueueListener thread, so logging calls only enqueue records.
+    Does nothing if logging was already set up in this process, which keeps
+    the first script's configuration when scripts import each other.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.FileHandler(log_file)]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+class Metrics:
+    """Process-wide counters and stage timings for one pipeline run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = datetime.now()
+        self.counters = Counter()
+        self.stage_seconds = {}
+
+    def incr(self, name, amount=1):
+        """Add `amount` to the named counter."""
+        with self._lock:
+            self.counters[name] += amount
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block and add its duration to the named stage."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + elapsed
+            logging.info(f"Stage '{name}' took {elapsed:.2f}s.")
+
+    def snapshot(self):
+        """Return the counters and timings as a JSON-serialisable dict."""
+        with self._lock:
+            return {
+                "started_at": self.started_at.strftime("%Y-%m-%d %H:%M:%S"),
+                "finished_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "counters": dict(self.counters),
+                "stage_seconds": {name: round(seconds, 3) for name, seconds in self.stage_seconds.items()},
+            }
+
+    def write(self, run_name, path=METRICS_FILE):
+        """
+        Store this run's snapshot under `run_name` in the JSON metrics file,
+        keeping the latest entries written by the other scripts.
+        """
+        all_metrics = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    all_metrics = json.load(f)
+            except (OSError, ValueError):
+                all_metrics = {}
+        all_metrics[run_name] = self.snapshot()
+        with open(path, "w") as f:
+            json.dump(all_metrics, f, indent=2)
+
+metrics = Metrics()
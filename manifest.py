@@ -0,0 +1,69 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime
+from instrumentation import metrics
+
+# JSON file holding the input hash of each stage's last successful run
+MANIFEST_FILE = "run_manifest.json"
+
+def content_hash(rows):
+    """
+    Return a BLAKE2b digest of an iterable of rows (tuples or lists).
+    Rows must come in a stable order (e.g. sorted by serial number).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for row in rows:
+        fields = ("\x00" if value is None else str(value) for value in row)
+        digest.update(("\x1f".join(fields) + "\x1e").encode("utf-8"))
+    return digest.hexdigest()
+
+def table_hash(conn, table_name, columns, order_by):
+    """Return the content hash of a SQLite table's columns, read in `order_by` order."""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(columns)} FROM {table_name} ORDER BY {order_by}")
+    return content_hash(cursor)
+
+def file_signature(path):
+    """Return a cheap signature (size and modification time) of a file, or 'absent'."""
+    if not os.path.exists(path):
+        return "absent"
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def combine_hashes(*parts):
+    """Combine several hashes and signatures into one input hash."""
+    return content_hash([parts])
+
+def load_manifest(path=MANIFEST_FILE):
+    """Load the run manifest, or an empty one if it is missing or unreadable."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def stage_unchanged(stage, input_hash, path=MANIFEST_FILE):
+    """
+    Return True if `stage` last succeeded with the same input hash, in which
+    case the caller can skip it.
+    """
+    entry = load_manifest(path).get(stage)
+    if entry and entry.get("input_hash") == input_hash:
+        logging.info(f"Stage '{stage}' input unchanged since {entry['recorded_at']}. Skipping.")
+        metrics.incr("stages_skipped")
+        return True
+    return False
+
+def record_stage(stage, input_hash, path=MANIFEST_FILE):
+    """Record the input hash of a successful run of `stage` in the manifest."""
+    manifest = load_manifest(path)
+    manifest[stage] = {
+        "input_hash": input_hash,
+        "recorded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2)
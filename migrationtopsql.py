@@ -1,6 +1,23 @@
 import sqlite3
-import psycopg2
-from psycopg2 import sql
+import logging
+import io
+import csv
+import time
+import zlib
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from instrumentation import setup_logging, metrics
+from bootstrap import lazy_import
+from storage import PUSH_JOURNAL_TABLE
+from manifest import table_hash, file_signature, combine_hashes, stage_unchanged, record_stage
+
+# Imported on first use, so diff-only runs that import this module skip psycopg2
+psycopg2 = lazy_import("psycopg2")
+sql = lazy_import("psycopg2.sql")
+errors = lazy_import("psycopg2.errors")
+psycopg2_extras = lazy_import("psycopg2.extras")
+psycopg2_pool = lazy_import("psycopg2.pool")
 
 # Configuration for SQLite database
 SQLITE_DB_PATH = "missing_data.db"  # Path to your SQLite database file
@@ -17,41 +34,59 @@ POSTGRES_CONFIG = {
 # Table name in PostgreSQL
 POSTGRES_TABLE = "cookstoves"
 
+# Columns copied from SQLite to PostgreSQL (when present in the PostgreSQL table)
+SOURCE_COLUMNS = ["serial_number", "manufacture_date"]
+
+# Rows per statement when falling back to execute_values
+INSERT_BATCH_SIZE = 1000
+
+# Rows committed per batch (and recorded in the push journal) by a resumable push
+PUSH_BATCH_SIZE = 5000
+
+# Journal table in the SQLite database recording each committed batch
+JOURNAL_TABLE = PUSH_JOURNAL_TABLE
+
+# Retries for a failed shard in a sharded push (each retry reloads only that shard)
+SHARD_RETRIES = 2
+
 def connect_to_sqlite():
     """Connect to the SQLite database."""
     try:
         conn = sqlite3.connect(SQLITE_DB_PATH)
-        print(f"[INFO] Connected to SQLite database at {SQLITE_DB_PATH}")
+        logging.info(f"Connected to SQLite database at {SQLITE_DB_PATH}")
         return conn
     except Exception as e:
-        print(f"[ERROR] Failed to connect to SQLite database: {e}")
+        logging.error(f"Failed to connect to SQLite database: {e}")
         raise
 
 def connect_to_postgres():
     """Connect to the PostgreSQL database."""
     try:
         conn = psycopg2.connect(**POSTGRES_CONFIG)
-        print("[INFO] Connected to PostgreSQL database.")
+        logging.info("Connected to PostgreSQL database.")
         return conn
     except Exception as e:
-        print(f"[ERROR] Failed to connect to PostgreSQL database: {e}")
+        logging.error(f"Failed to connect to PostgreSQL database: {e}")
         raise
 
 def get_table_name_from_sqlite(conn):
-    """Retrieve the name of the single table in the SQLite database."""
+    """Retrieve the name of the single data table in the SQLite database (ignoring the push journal)."""
     try:
         cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT IN (?, 'sqlite_sequence');",
+            (JOURNAL_TABLE,)
+        )
         tables = cursor.fetchall()
 
         if len(tables) != 1:
             raise ValueError(f"Expected 1 table in SQLite database, but found {len(tables)} tables.")
 
         table_name = tables[0][0]
-        print(f"[INFO] Found table in SQLite database: {table_name}")
+        logging.info(f"Found table in SQLite database: {table_name}")
         return table_name
     except Exception as e:
-        print(f"[ERROR] Failed to retrieve table name from SQLite database: {e}")
+        logging.error(f"Failed to retrieve table name from SQLite database: {e}")
         raise
 
 def fetch_data_from_sqlite(conn, table_name):
@@ -61,12 +96,34 @@ def fetch_data_from_sqlite(conn, table_name):
         query = f"SELECT serial_number, manufacture_date FROM {table_name};"
         cursor.execute(query)
         rows = cursor.fetchall()
-        print(f"[INFO] Fetched {len(rows)} rows from SQLite database.")
+        logging.info(f"Fetched {len(rows)} rows from SQLite database.")
         return rows
     except Exception as e:
-        print(f"[ERROR] Failed to fetch data from SQLite database: {e}")
+        logging.error(f"Failed to fetch data from SQLite database: {e}")
         raise
 
+def fetch_data_from_arrow(path):
+    """
+    Read a change set exported by compare.py/dbfetch.py --export as an Arrow
+    table. Arrow IPC files are memory-mapped rather than built into tuples.
+    """
+    from changeset import read_changeset
+    try:
+        table = read_changeset(path)
+        logging.info(f"Read {table.num_rows} rows from {path}.")
+        return table
+    except Exception as e:
+        logging.error(f"Failed to read change set {path}: {e}")
+        raise
+
+def _is_arrow_table(rows):
+    """Tell a pyarrow.Table from a list of row tuples without importing pyarrow."""
+    return type(rows).__module__.startswith("pyarrow")
+
+def arrow_to_rows(table):
+    """Convert an Arrow table to a list of row tuples."""
+    return list(zip(*(column.to_pylist() for column in table.columns)))
+
 def get_postgres_table_columns(conn):
     """Retrieve the column names of the PostgreSQL table."""
     try:
@@ -76,74 +133,414 @@ def get_postgres_table_columns(conn):
             [POSTGRES_TABLE]
         )
         columns = [row[0] for row in cursor.fetchall()]
-        print(f"[INFO] Retrieved columns from PostgreSQL table '{POSTGRES_TABLE}': {columns}")
+        logging.info(f"Retrieved columns from PostgreSQL table '{POSTGRES_TABLE}': {columns}")
         return columns
     except Exception as e:
-        print(f"[ERROR] Failed to retrieve columns from PostgreSQL table: {e}")
+        logging.error(f"Failed to retrieve columns from PostgreSQL table: {e}")
         raise
 
-def reset_sequence(conn):
-    """Reset the sequence for the 'id' column in the PostgreSQL table."""
+def sync_id_sequence(cursor):
+    """
+    Advance the sequence behind the table's 'id' column so it is at least the
+    highest id in the table, inside the caller's transaction.
+    The id column is looked up in information_schema first, since
+    pg_get_serial_sequence raises (aborting the transaction) for a missing
+    column. The highest id is read with an index-only ORDER BY id DESC LIMIT 1
+    and GREATEST with the sequence's last value means it never moves
+    backwards. An empty table leaves the sequence alone, so the first id stays 1.
+    """
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = ANY (current_schemas(false)) AND table_name = %s AND column_name = 'id';
+    """, [POSTGRES_TABLE])
+    sequence = None
+    if cursor.fetchone():
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id');", [POSTGRES_TABLE])
+        sequence = cursor.fetchone()[0]
+    if sequence is None:
+        logging.info(f"Table '{POSTGRES_TABLE}' has no serial 'id' column; no sequence to sync.")
+        return
+
+    cursor.execute(sql.SQL("SELECT id FROM {} ORDER BY id DESC LIMIT 1;").format(sql.Identifier(POSTGRES_TABLE)))
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
+        logging.info(f"Table '{POSTGRES_TABLE}' is empty; sequence '{sequence}' left as is.")
+        return
+    cursor.execute(
+        "SELECT setval(%s::regclass, GREATEST(COALESCE(pg_sequence_last_value(%s::regclass), 0), %s), true);",
+        [sequence, sequence, row[0]]
+    )
+    logging.info(f"Synced sequence '{sequence}' to {cursor.fetchone()[0]}")
+
+def _copy_into_staging(cursor, rows, columns_sql):
+    """Stream rows (tuples or an Arrow table) into a temporary staging table with COPY ... FROM STDIN."""
+    staging = sql.Identifier(f"{POSTGRES_TABLE}_staging")
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS pg_temp.{}").format(staging))
+    cursor.execute(
+        sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(
+            staging, columns_sql, sql.Identifier(POSTGRES_TABLE)
+        )
+    )
+
+    if _is_arrow_table(rows):
+        from changeset import write_csv
+        buffer = io.BytesIO()
+        write_csv(rows, buffer)
+    else:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    copy_query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(staging, columns_sql)
+    cursor.copy_expert(copy_query.as_string(cursor), buffer)
+    return staging
+
+def _insert_with_copy(cursor, rows, columns_sql):
+    """Bulk-load rows through a COPY'd staging table and a single INSERT ... SELECT."""
+    staging = _copy_into_staging(cursor, rows, columns_sql)
+    cursor.execute(sql.SQL("""
+        INSERT INTO {} ({})
+        SELECT {} FROM {}
+        ON CONFLICT (serial_number) DO NOTHING;
+    """).format(sql.Identifier(POSTGRES_TABLE), columns_sql, columns_sql, staging))
+    return cursor.rowcount
+
+def _insert_with_values(cursor, rows, columns_sql):
+    """Insert rows in execute_values batches, counting the rows actually inserted."""
+    query = sql.SQL("""
+        INSERT INTO {} ({})
+        VALUES %s
+        ON CONFLICT (serial_number) DO NOTHING
+        RETURNING 1;
+    """).format(sql.Identifier(POSTGRES_TABLE), columns_sql)
+    inserted = psycopg2_extras.execute_values(cursor, query.as_string(cursor), rows, page_size=INSERT_BATCH_SIZE, fetch=True)
+    return len(inserted)
+
+def _insert_row_by_row(cursor, rows, columns_sql, column_count):
+    """Insert rows one statement at a time."""
+    placeholders = ", ".join(["%s"] * column_count)
+    query = sql.SQL("""
+        INSERT INTO {} ({})
+        VALUES ({})
+        ON CONFLICT (serial_number) DO NOTHING;
+    """).format(sql.Identifier(POSTGRES_TABLE), columns_sql, sql.SQL(placeholders))
+
+    inserted_count = 0
+    for values in rows:
+        cursor.execute(query, values)
+        inserted_count += cursor.rowcount
+    return inserted_count
+
+def insert_data_into_postgres(conn, rows, postgres_columns, method="copy", sync_sequence=True):
+    """
+    Insert data into the PostgreSQL table based on its schema.
+
+    method is one of:
+    - "copy": COPY the rows into a temporary staging table, then run one
+      INSERT ... SELECT ... ON CONFLICT DO NOTHING. Falls back to "values"
+      if the server does not allow COPY.
+    - "values": execute_values batches of INSERT_BATCH_SIZE rows.
+    - "row": one INSERT per row.
+
+    rows may also be an Arrow table (see fetch_data_from_arrow), which COPY
+    writes out column-wise without building a tuple per row.
+
+    When there are rows to push and sync_sequence is set, the id sequence is
+    first synced (see sync_id_sequence) in the same transaction, so new rows
+    cannot collide with ids written by other tools. Empty pushes skip it.
+    """
     try:
         cursor = conn.cursor()
-        cursor.execute(sql.SQL("SELECT MAX(id) FROM {}").format(sql.Identifier(POSTGRES_TABLE)))
-        max_id = cursor.fetchone()[0] or 0  # Default to 0 if no records exist
-        
-        sequence_name = f"{POSTGRES_TABLE}_id_seq"
-        cursor.execute(sql.SQL("SELECT setval(%s, %s, true);"), [sequence_name, max_id + 1])
-        print(f"[INFO] Reset sequence '{sequence_name}' to {max_id + 1}")
+        available_columns = [col for col in SOURCE_COLUMNS if col in postgres_columns]
+        columns_sql = sql.SQL(", ").join(map(sql.Identifier, available_columns))
+        if _is_arrow_table(rows):
+            # Exported change sets already hold real nulls
+            values = rows.select(available_columns)
+            if method != "copy":
+                values = arrow_to_rows(values)
+        else:
+            # process_data stores missing values as the string "NULL"; send them as real NULLs
+            values = [
+                [None if row[i] == "NULL" else row[i] for i, col in enumerate(SOURCE_COLUMNS) if col in available_columns]
+                for row in rows
+            ]
+
+        if not len(values):
+            logging.info(f"No rows to insert into PostgreSQL table '{POSTGRES_TABLE}'.")
+            return 0
+        if sync_sequence:
+            sync_id_sequence(cursor)
+
+        if method == "copy":
+            cursor.execute("SAVEPOINT bulk_copy")
+            try:
+                inserted_count = _insert_with_copy(cursor, values, columns_sql)
+                cursor.execute("RELEASE SAVEPOINT bulk_copy")
+            except (errors.InsufficientPrivilege, errors.FeatureNotSupported) as e:
+                logging.warning(f"COPY not allowed ({e}); falling back to batched inserts.")
+                cursor.execute("ROLLBACK TO SAVEPOINT bulk_copy")
+                if _is_arrow_table(values):
+                    values = arrow_to_rows(values)
+                inserted_count = _insert_with_values(cursor, values, columns_sql)
+        elif method == "values":
+            inserted_count = _insert_with_values(cursor, values, columns_sql)
+        else:
+            inserted_count = _insert_row_by_row(cursor, values, columns_sql, len(available_columns))
+
         conn.commit()
+        metrics.incr("rows_inserted", inserted_count)
+        logging.info(f"Inserted {inserted_count} of {len(values)} rows into PostgreSQL table '{POSTGRES_TABLE}'.")
+        return inserted_count
     except Exception as e:
-        print(f"[ERROR] Failed to reset sequence: {e}")
+        logging.error(f"Failed to insert data into PostgreSQL table: {e}")
         conn.rollback()
         raise
 
-def insert_data_into_postgres(conn, rows, postgres_columns):
-    """Insert data into the PostgreSQL table based on its schema."""
+def update_manufacture_dates(conn, rows):
+    """
+    Set manufacture_date from (serial_number, manufacture_date) rows with
+    batched UPDATE ... FROM (VALUES ...) statements in one transaction.
+    Returns the number of rows updated.
+    """
     try:
         cursor = conn.cursor()
-        inserted_count = 0
-        available_columns = [col for col in ["serial_number", "manufacture_date"] if col in postgres_columns]
-        placeholders = ", ".join(["%s"] * len(available_columns))
-        columns_sql = sql.SQL(", ").join(map(sql.Identifier, available_columns))
-
         query = sql.SQL("""
-            INSERT INTO {} ({})
-            VALUES ({})
-            ON CONFLICT (serial_number) DO NOTHING;
-        """).format(sql.Identifier(POSTGRES_TABLE), columns_sql, sql.SQL(placeholders))
-
-        for row in rows:
-            values = [row[i] for i, col in enumerate(["serial_number", "manufacture_date"]) if col in available_columns]
-            cursor.execute(query, values)
-            inserted_count += cursor.rowcount
-
+            UPDATE {table} AS target
+            SET manufacture_date = source.manufacture_date::timestamp
+            FROM (VALUES %s) AS source(serial_number, manufacture_date)
+            WHERE target.serial_number = source.serial_number
+            RETURNING 1;
+        """).format(table=sql.Identifier(POSTGRES_TABLE))
+        updated = psycopg2_extras.execute_values(cursor, query.as_string(cursor), rows, page_size=INSERT_BATCH_SIZE, fetch=True)
         conn.commit()
-        print(f"[INFO] Inserted {inserted_count} rows into PostgreSQL table '{POSTGRES_TABLE}'.")
-        return inserted_count
+        metrics.incr("rows_updated", len(updated))
+        logging.info(f"Updated manufacture_date of {len(updated)} rows in PostgreSQL table '{POSTGRES_TABLE}'.")
+        return len(updated)
     except Exception as e:
-        print(f"[ERROR] Failed to insert data into PostgreSQL table: {e}")
+        logging.error(f"Failed to update PostgreSQL table: {e}")
         conn.rollback()
         raise
 
-def main():
-    print("[START] Starting the script to transfer data from SQLite to PostgreSQL...")
-    sqlite_conn = connect_to_sqlite()
-    sqlite_table_name = get_table_name_from_sqlite(sqlite_conn)
-    rows = fetch_data_from_sqlite(sqlite_conn, sqlite_table_name)
+def ensure_push_journal(conn):
+    """Create the journal of committed push batches in the SQLite database."""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {JOURNAL_TABLE} (
+            batch_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_table TEXT NOT NULL,
+            first_rowid INTEGER NOT NULL,
+            last_rowid INTEGER NOT NULL,
+            row_count INTEGER NOT NULL,
+            inserted_count INTEGER NOT NULL,
+            committed_at TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+
+def get_last_checkpoint(conn, table_name):
+    """Return the last SQLite rowid of the table already committed to PostgreSQL (0 if none)."""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT MAX(last_rowid) FROM {JOURNAL_TABLE} WHERE source_table = ?", (table_name,))
+    return cursor.fetchone()[0] or 0
+
+def clear_push_journal(conn, table_name):
+    """Forget every checkpoint of the table so the next push starts from the first row."""
+    conn.execute(f"DELETE FROM {JOURNAL_TABLE} WHERE source_table = ?", (table_name,))
+    conn.commit()
+    logging.info(f"Cleared push journal for SQLite table '{table_name}'.")
+
+def iter_sqlite_batches(conn, table_name, after_rowid=0, batch_size=PUSH_BATCH_SIZE):
+    """Yield (first rowid, last rowid, rows) batches of the table in rowid order, after `after_rowid`."""
+    cursor = conn.cursor()
+    while True:
+        cursor.execute(
+            f"SELECT rowid, serial_number, manufacture_date FROM {table_name} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (after_rowid, batch_size)
+        )
+        batch = cursor.fetchall()
+        if not batch:
+            return
+        yield batch[0][0], batch[-1][0], [row[1:] for row in batch]
+        after_rowid = batch[-1][0]
+
+def push_resumable(sqlite_conn, table_name, postgres_conn, postgres_columns, method="copy", batch_size=PUSH_BATCH_SIZE):
+    """
+    Push the SQLite table to PostgreSQL in batches of `batch_size` rows, each in
+    its own PostgreSQL transaction. Every committed batch is recorded in the
+    push journal, and a later run resumes after the last recorded batch.
+    A batch committed to PostgreSQL but not journaled is simply pushed again;
+    ON CONFLICT DO NOTHING makes that a no-op. Returns the inserted count.
+    """
+    ensure_push_journal(sqlite_conn)
+    resume_after = get_last_checkpoint(sqlite_conn, table_name)
+    if resume_after:
+        logging.info(f"Resuming push of '{table_name}' after rowid {resume_after}.")
+
+    inserted_total = 0
+    batches = 0
+    for first_rowid, last_rowid, rows in iter_sqlite_batches(sqlite_conn, table_name, resume_after, batch_size):
+        inserted_count = insert_data_into_postgres(postgres_conn, rows, postgres_columns, method=method)
+        sqlite_conn.execute(f"""
+            INSERT INTO {JOURNAL_TABLE}
+                (source_table, first_rowid, last_rowid, row_count, inserted_count, committed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (table_name, first_rowid, last_rowid, len(rows), inserted_count, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        sqlite_conn.commit()
+        inserted_total += inserted_count
+        batches += 1
+
+    logging.info(f"Pushed {batches} batches of '{table_name}'; {inserted_total} rows inserted.")
+    return inserted_total
+
+def create_connection_pool(size):
+    """Create a thread-safe pool of up to `size` PostgreSQL connections."""
+    pool = psycopg2_pool.ThreadedConnectionPool(1, size, **POSTGRES_CONFIG)
+    logging.info(f"Created PostgreSQL connection pool with up to {size} connections.")
+    return pool
+
+def shard_rows(rows, shards):
+    """Split rows into `shards` lists by a stable hash (CRC-32) of the serial number."""
+    buckets = [[] for _ in range(shards)]
+    for row in rows:
+        buckets[zlib.crc32(str(row[0]).encode("utf-8")) % shards].append(row)
+    return buckets
+
+def _insert_shard(pool, shard_id, rows, postgres_columns, method, retries):
+    """
+    Load one shard on its own pooled connection and transaction, retrying only
+    this shard after PostgreSQL errors. A connection that saw an error is
+    closed rather than returned to the pool for reuse.
+    """
+    for attempt in range(1, retries + 2):
+        conn = pool.getconn()
+        failed = True
+        try:
+            inserted_count = insert_data_into_postgres(conn, rows, postgres_columns, method=method)
+            failed = False
+            return inserted_count
+        except psycopg2.Error as e:
+            if attempt > retries:
+                raise RuntimeError(f"failed after {attempt} attempts: {e}") from e
+            logging.warning(f"Shard {shard_id} failed ({e}); retrying ({attempt}/{retries}).")
+        except Exception as e:
+            raise RuntimeError(f"failed after {attempt} attempts: {e}") from e
+        finally:
+            pool.putconn(conn, close=failed)
+        time.sleep(2 ** (attempt - 1))
+
+def insert_sharded(pool, rows, postgres_columns, shards, method="copy", retries=SHARD_RETRIES):
+    """
+    Insert rows in parallel: the rows are split into `shards` by serial number
+    hash and each shard is loaded and committed on its own pooled connection.
+    A failing shard is retried on its own and never rolls back the others.
+    Returns a report with the total, inserted and conflicted row counts and
+    the ids of shards that still failed.
+    """
+    buckets = shard_rows(rows, shards)
+    report = {"rows": len(rows), "inserted": 0, "conflicted": 0, "failed_shards": [], "failed_rows": 0}
+
+    with ThreadPoolExecutor(max_workers=shards) as executor:
+        futures = {
+            executor.submit(_insert_shard, pool, shard_id, bucket, postgres_columns, method, retries): shard_id
+            for shard_id, bucket in enumerate(buckets) if bucket
+        }
+        for future in as_completed(futures):
+            shard_id = futures[future]
+            shard_size = len(buckets[shard_id])
+            try:
+                inserted_count = future.result()
+            except Exception as e:
+                logging.error(f"Shard {shard_id} ({shard_size} rows) {e}")
+                report["failed_shards"].append(shard_id)
+                report["failed_rows"] += shard_size
+                continue
+            report["inserted"] += inserted_count
+            report["conflicted"] += shard_size - inserted_count
+
+    logging.info(
+        f"Sharded insert into '{POSTGRES_TABLE}': {report['inserted']} inserted, {report['conflicted']} already present, "
+        f"{report['failed_rows']} in failed shards {sorted(report['failed_shards'])} ({shards} shards)."
+    )
+    return report
+
+def push_input_hash(source_hash):
+    """Combine the hash of the rows to push with the PostgreSQL target they are pushed to."""
+    target = f"{POSTGRES_CONFIG['host']}:{POSTGRES_CONFIG['port']}/{POSTGRES_CONFIG['dbname']}/{POSTGRES_TABLE}"
+    return combine_hashes(source_hash, target)
+
+def main(method="copy", shards=1, batch_size=PUSH_BATCH_SIZE, restart=False, force=False, arrow_path=None):
+    logging.info("Starting the script to transfer data from SQLite to PostgreSQL...")
+    if arrow_path:
+        sqlite_conn = None
+        input_hash = push_input_hash(f"{arrow_path}:{file_signature(arrow_path)}")
+    else:
+        sqlite_conn = connect_to_sqlite()
+        sqlite_table_name = get_table_name_from_sqlite(sqlite_conn)
+        input_hash = push_input_hash(table_hash(sqlite_conn, sqlite_table_name, SOURCE_COLUMNS, "serial_number"))
+
+    # Skip the push (and PostgreSQL entirely) if these rows were already pushed
+    if not (force or restart) and stage_unchanged("push", input_hash):
+        if sqlite_conn:
+            sqlite_conn.close()
+        metrics.write("migrationtopsql")
+        return
+
     postgres_conn = connect_to_postgres()
     postgres_columns = get_postgres_table_columns(postgres_conn)
     
-    print("[INFO] Resetting sequence before insertion.")
-    reset_sequence(postgres_conn)
-    inserted_count = insert_data_into_postgres(postgres_conn, rows, postgres_columns)
-    
-    print("[INFO] Resetting sequence after insertion.")
-    reset_sequence(postgres_conn)
+    with metrics.stage("push"):
+        if arrow_path and shards <= 1:
+            insert_data_into_postgres(postgres_conn, fetch_data_from_arrow(arrow_path), postgres_columns, method=method)
+        elif shards > 1:
+            if arrow_path:
+                rows = arrow_to_rows(fetch_data_from_arrow(arrow_path).select(SOURCE_COLUMNS))
+            else:
+                rows = fetch_data_from_sqlite(sqlite_conn, sqlite_table_name)
+            pool = create_connection_pool(shards)
+            try:
+                report = insert_sharded(pool, rows, postgres_columns, shards, method=method)
+            finally:
+                pool.closeall()
+        else:
+            ensure_push_journal(sqlite_conn)
+            if restart:
+                clear_push_journal(sqlite_conn, sqlite_table_name)
+            push_resumable(sqlite_conn, sqlite_table_name, postgres_conn, postgres_columns, method=method, batch_size=batch_size)
     
-    sqlite_conn.close()
+    if sqlite_conn:
+        sqlite_conn.close()
     postgres_conn.close()
-    print("[END] Script completed successfully.")
+    metrics.write("migrationtopsql")
+    if shards > 1 and report["failed_shards"]:
+        raise RuntimeError(f"{len(report['failed_shards'])} shards failed; rerun to retry them (already inserted rows are skipped).")
+    record_stage("push", input_hash)
+    logging.info("Script completed successfully.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Configure logging to both file and console
+    setup_logging("migration.log")
+    parser = argparse.ArgumentParser(description="Push missing_data.db rows into PostgreSQL.")
+    parser.add_argument(
+        "--method", choices=["copy", "values", "row"], default="copy",
+        help="bulk-load strategy (default: copy)"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=1,
+        help="split the rows by serial number hash and load N shards in parallel (default: 1)"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=PUSH_BATCH_SIZE,
+        help=f"rows committed and journaled per batch (default: {PUSH_BATCH_SIZE})"
+    )
+    parser.add_argument(
+        "--restart", action="store_true",
+        help=f"ignore the {JOURNAL_TABLE} checkpoints and push every row again"
+    )
+    parser.add_argument("--force", action="store_true", help="push even if the missing set is unchanged since the last push")
+    parser.add_argument(
+        "--from-arrow", metavar="PATH",
+        help="push a change set exported with compare.py/dbfetch.py --export instead of missing_data.db"
+    )
+    args = parser.parse_args()
+    main(
+        method=args.method, shards=args.shards, batch_size=args.batch_size,
+        restart=args.restart, force=args.force, arrow_path=args.from_arrow
+    )
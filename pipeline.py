@@ -0,0 +1,223 @@
+import os
+import logging
+import argparse
+from collections import Counter, defaultdict, namedtuple
+from contextlib import closing
+
+import gsheetfetch
+import migrationtopsql
+from bootstrap import lazy_import
+from diffengine import (
+    find_missing_in_batch, find_missing_serials_in_postgres, store_missing_rows,
+    get_table_name, create_missing_db_structure, create_missing_table, MISSING_TABLE
+)
+from instrumentation import setup_logging, metrics
+from manifest import content_hash, file_signature, combine_hashes, stage_unchanged, record_stage
+from storage import open_db, ensure_clean_record, upsert_processed_rows, log_duplicates
+
+LOCAL_DB = "local_data.db"
+PROCESSED_DB = "processed_data.db"
+MISSING_DB = "missing_data.db"
+
+# serialindex needs NumPy, which only the local_data.db diff stage uses (not --live)
+serialindex = lazy_import("serialindex")
+
+# Columnar hand-off between stages: one list per column, aligned by position
+RowBatch = namedtuple("RowBatch", ["serial_numbers", "manufacture_dates"])
+
+def fetch_stage(service, creds, sources=gsheetfetch.SHEET_SOURCES):
+    """
+    Fetch and transform the sheet sources page by page into one columnar batch.
+    Rows without a serial number are dropped and a later row for the same
+    serial number replaces an earlier one, as in processed_data.db: rows are
+    collected per source and merged in `sources` order, so the winner between
+    sources does not depend on which pages arrive first.
+    """
+    rows_by_source = defaultdict(dict)
+    date_failures = Counter()
+    duplicates = Counter()
+    with closing(gsheetfetch.fetch_sources(service, creds, sources)) as pages:
+        for source, block, page in pages:
+            source_rows = rows_by_source[source]
+            data_rows = page[1:] if block == 0 else page  # Skip the header row
+            metrics.incr("rows_fetched", len(data_rows))
+            metrics.incr("rows_parsed", len(data_rows))
+            for serial_number, manufacture_date in gsheetfetch.transform_rows(data_rows, date_failures):
+                if serial_number != "NULL":
+                    if serial_number in source_rows:
+                        duplicates[serial_number] += 1
+                    source_rows[serial_number] = manufacture_date
+    latest = gsheetfetch.merge_sources(rows_by_source, sources, duplicates)
+    gsheetfetch.log_date_failures(date_failures)
+    log_duplicates(duplicates, "the sheet", "the last row of the last source kept")
+    metrics.incr("duplicate_serials", len(duplicates))
+    metrics.incr("date_failures", sum(date_failures.values()))
+    logging.info(f"Fetched {len(latest)} distinct serial numbers from the sheet.")
+    return RowBatch(list(latest.keys()), list(latest.values()))
+
+def diff_stage(batch, local_db=LOCAL_DB, live=False):
+    """
+    Return the rows of the batch whose serial number is not in local_data.db,
+    or not in the PostgreSQL table itself when live is set.
+    """
+    if live:
+        conn = migrationtopsql.connect_to_postgres()
+        try:
+            missing_serials = find_missing_serials_in_postgres(conn, batch.serial_numbers, migrationtopsql.POSTGRES_TABLE)
+        finally:
+            conn.close()
+        missing_rows = [
+            (serial_number, manufacture_date)
+            for serial_number, manufacture_date in zip(batch.serial_numbers, batch.manufacture_dates)
+            if serial_number in missing_serials
+        ]
+        metrics.incr("rows_missing", len(missing_rows))
+        logging.info(f"Found {len(missing_rows)} serial numbers missing from PostgreSQL.")
+        return missing_rows
+
+    local_table = get_table_name(local_db)
+    if not local_table:
+        raise RuntimeError(f"Could not determine table name from {local_db}.")
+    serial_index = serialindex.load_serial_index(local_db, local_table)
+    missing_rows = find_missing_in_batch(batch.serial_numbers, batch.manufacture_dates, serial_index)
+    logging.info(f"Found {len(missing_rows)} missing serial numbers ({len(serial_index)} known locally).")
+    return missing_rows
+
+def push_stage(missing_rows, method="copy", shards=1):
+    """Insert the missing rows into PostgreSQL and return the inserted count."""
+    if not missing_rows:
+        logging.info("No missing rows to push.")
+        return 0
+    conn = migrationtopsql.connect_to_postgres()
+    try:
+        postgres_columns = migrationtopsql.get_postgres_table_columns(conn)
+        if shards <= 1:
+            return migrationtopsql.insert_data_into_postgres(conn, missing_rows, postgres_columns, method=method)
+    finally:
+        conn.close()
+
+    pool = migrationtopsql.create_connection_pool(shards)
+    try:
+        report = migrationtopsql.insert_sharded(pool, missing_rows, postgres_columns, shards, method=method)
+    finally:
+        pool.closeall()
+    if report["failed_shards"]:
+        raise RuntimeError(f"{len(report['failed_shards'])} shards failed; rerun to retry them.")
+    return report["inserted"]
+
+def write_checkpoint(batch, missing_rows, local_db=LOCAL_DB):
+    """
+    Persist the intermediate stages to processed_data.db and missing_data.db.
+    clean_record is replaced by the fetched sheet; its rows carry no sync
+    block, so the next gsheet.py run rebuilds the table.
+    """
+    with open_db(PROCESSED_DB) as conn:
+        ensure_clean_record(conn)
+        conn.execute("DELETE FROM clean_record")
+        upsert_processed_rows(conn, list(zip(batch.serial_numbers, batch.manufacture_dates)))
+        conn.commit()
+    if os.path.exists(MISSING_DB):
+        local_table = get_table_name(MISSING_DB)
+    elif os.path.exists(local_db):
+        local_table = get_table_name(local_db)
+        create_missing_db_structure(local_db, MISSING_DB, local_table)
+    else:
+        local_table = MISSING_TABLE
+        create_missing_table(MISSING_DB, local_table)
+    store_missing_rows(MISSING_DB, local_table, missing_rows)
+    logging.info(f"Checkpoint written to {PROCESSED_DB} and {MISSING_DB}.")
+
+def batch_input_hash(batch, local_db=LOCAL_DB, **options):
+    """Hash the fetched sheet (sorted serial/date pairs), local_data.db and the run options."""
+    sheet = content_hash(sorted(zip(batch.serial_numbers, batch.manufacture_dates)))
+    return combine_hashes(sheet, file_signature(local_db), *(f"{name}={value}" for name, value in sorted(options.items())))
+
+def revision_input_hash(creds, sources=gsheetfetch.SHEET_SOURCES, local_db=LOCAL_DB, **options):
+    """
+    Hash the Drive revisions of the sheets, local_data.db and the run options,
+    or return None if a revision cannot be read (the sheet must then be fetched).
+    """
+    revisions = {}
+    for sheet_id, _ in sources:
+        if sheet_id not in revisions:
+            revisions[sheet_id] = gsheetfetch.get_sheet_revision(creds, sheet_id)
+    if None in revisions.values():
+        return None
+    return combine_hashes(
+        *(f"{sheet_id}@{revision}" for sheet_id, revision in sorted(revisions.items())),
+        file_signature(local_db), *(f"{name}={value}" for name, value in sorted(options.items()))
+    )
+
+def run_pipeline(checkpoint=False, push=True, method="copy", live=False, shards=1, force=False):
+    """
+    Run fetch -> diff -> push in one process, handing data between stages in memory.
+    Nothing is fetched when the Drive revisions of the sheets and local_data.db
+    are unchanged since the last successful run, and the diff and push are
+    skipped when the fetched sheet content is unchanged, unless force is set.
+    Live runs are never skipped, since the PostgreSQL table they diff against
+    can change without any of these inputs changing.
+    """
+    creds = gsheetfetch.authenticate()
+    revision_hash = None if live else revision_input_hash(creds, checkpoint=checkpoint, push=push)
+    if not force and revision_hash and stage_unchanged("pipeline_revision", revision_hash):
+        return 0
+
+    with metrics.stage("fetch"):
+        service = gsheetfetch.get_sheets_service(creds)
+        batch = fetch_stage(service, creds)
+
+    input_hash = None if live else batch_input_hash(batch, checkpoint=checkpoint, push=push)
+    if input_hash and not force and stage_unchanged("pipeline", input_hash):
+        if revision_hash:
+            record_stage("pipeline_revision", revision_hash)
+        return 0
+
+    with metrics.stage("diff"):
+        missing_rows = diff_stage(batch, live=live)
+
+    if checkpoint:
+        with metrics.stage("checkpoint"):
+            write_checkpoint(batch, missing_rows)
+
+    inserted_count = 0
+    if push:
+        with metrics.stage("push"):
+            inserted_count = push_stage(missing_rows, method=method, shards=shards)
+
+    if input_hash:
+        record_stage("pipeline", input_hash)
+    if revision_hash:
+        record_stage("pipeline_revision", revision_hash)
+    logging.info(f"Pipeline finished: {len(missing_rows)} missing, {inserted_count} inserted.")
+    return inserted_count
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Google Sheets -> PostgreSQL pipeline in one process.")
+    parser.add_argument(
+        "--checkpoint", action="store_true",
+        help=f"also write the intermediate {PROCESSED_DB} and {MISSING_DB} files"
+    )
+    parser.add_argument("--no-push", action="store_true", help="stop after the diff stage")
+    parser.add_argument(
+        "--live", action="store_true",
+        help=f"diff against the PostgreSQL table instead of the {LOCAL_DB} snapshot"
+    )
+    parser.add_argument(
+        "--method", choices=["copy", "values", "row"], default="copy",
+        help="PostgreSQL bulk-load strategy (default: copy)"
+    )
+    parser.add_argument("--shards", type=int, default=1, help="load the missing rows in N parallel shards")
+    parser.add_argument("--force", action="store_true", help="run the diff and push even if the sheet is unchanged")
+    args = parser.parse_args()
+    # Configure logging to both file and console
+    setup_logging("pipeline.log")
+    try:
+        run_pipeline(checkpoint=args.checkpoint, push=not args.no_push, method=args.method, live=args.live, shards=args.shards, force=args.force)
+    except Exception as e:
+        logging.error(f"Pipeline failed: {e}")
+        raise
+    finally:
+        metrics.write("pipeline")
+
+if __name__ == "__main__":
+    main()
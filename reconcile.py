@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import logging
+import argparse
+from contextlib import closing
+from itertools import islice
+
+from diffengine import reconcile_sorted
+from migrationtopsql import (
+    connect_to_postgres, get_table_name_from_sqlite, update_manufacture_dates, sql, POSTGRES_TABLE
+)
+from instrumentation import setup_logging, metrics
+from storage import open_db
+
+# Configure logging to both file and console
+setup_logging("data_check.log")
+
+PROCESSED_DB = "processed_data.db"
+LOCAL_DB = "local_data.db"
+
+# SQLite file the three reconciliation sets are written to (replaced on every run)
+REPORT_DB = "reconcile_report.db"
+
+# Rows written to the report per executemany call
+REPORT_BATCH_SIZE = 10000
+
+# Rows fetched per round trip by the server-side PostgreSQL cursor
+POSTGRES_FETCH_SIZE = 10000
+
+REPORT_TABLES = ("only_in_sheet", "only_in_db", "different")
+
+def iter_sheet_rows(conn):
+    """Stream the processed sheet rows (clean_record) ordered by serial number."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT column_a, column_c FROM clean_record
+        WHERE column_a IS NOT NULL AND column_a != 'NULL'
+        ORDER BY column_a
+    """)
+    return cursor
+
+def iter_local_rows(conn, table_name):
+    """Stream the local_data.db snapshot rows ordered by serial number (as text, byte order)."""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT CAST(serial_number AS TEXT) AS serial, manufacture_date FROM {table_name}
+        WHERE serial_number IS NOT NULL
+        ORDER BY serial
+    """)
+    return cursor
+
+def iter_postgres_rows(conn, table_name=POSTGRES_TABLE):
+    """
+    Stream the PostgreSQL rows ordered by serial number through a server-side
+    cursor. COLLATE "C" gives the same byte order as SQLite and Python.
+    """
+    cursor = conn.cursor(name="reconcile_rows")
+    cursor.itersize = POSTGRES_FETCH_SIZE
+    cursor.execute(sql.SQL("""
+        SELECT serial_number, manufacture_date FROM {}
+        WHERE serial_number IS NOT NULL
+        ORDER BY serial_number COLLATE "C"
+    """).format(sql.Identifier(table_name)))
+    return cursor
+
+def create_report(conn):
+    """(Re)create the report tables."""
+    for table_name in REPORT_TABLES:
+        conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+        conn.execute(f"CREATE TABLE {table_name} (serial_number TEXT PRIMARY KEY, sheet_date TEXT, db_date TEXT)")
+
+def write_report(conn, results):
+    """Write the (kind, serial_number, sheet_date, db_date) results to the report tables. Returns counts per kind."""
+    counts = dict.fromkeys(REPORT_TABLES, 0)
+    while True:
+        chunk = list(islice(results, REPORT_BATCH_SIZE))
+        if not chunk:
+            break
+        for kind in REPORT_TABLES:
+            rows = [row[1:] for row in chunk if row[0] == kind]
+            conn.executemany(f"INSERT INTO {kind} (serial_number, sheet_date, db_date) VALUES (?, ?, ?)", rows)
+            counts[kind] += len(rows)
+        conn.commit()
+    return counts
+
+def reconcile(live=False, apply_updates=False, report_db=REPORT_DB):
+    """
+    Compare the processed sheet with local_data.db (or the PostgreSQL table
+    when live is set) in one sorted-merge pass and write the serial numbers
+    only in the sheet, only in the database, and present with a different
+    manufacture_date to report_db. With apply_updates (live only) the
+    database dates of the mismatches are set to the sheet's dates.
+    """
+    if apply_updates and not live:
+        raise ValueError("--apply-updates needs --live: updates go to the PostgreSQL table.")
+
+    if os.path.exists(report_db):
+        os.remove(report_db)
+    pg_conn = connect_to_postgres() if live else None
+    try:
+        with open_db(PROCESSED_DB) as sheet_conn, open_db(report_db) as report_conn:
+            create_report(report_conn)
+            with metrics.stage("reconcile"):
+                if live:
+                    db_rows = iter_postgres_rows(pg_conn)
+                    source = f"PostgreSQL table '{POSTGRES_TABLE}'"
+                    counts = write_report(report_conn, reconcile_sorted(iter_sheet_rows(sheet_conn), db_rows))
+                    db_rows.close()
+                    pg_conn.rollback()
+                else:
+                    with closing(sqlite3.connect(LOCAL_DB)) as local_conn:
+                        local_table = get_table_name_from_sqlite(local_conn)
+                        db_rows = iter_local_rows(local_conn, local_table)
+                        source = f"{LOCAL_DB} ({local_table})"
+                        counts = write_report(report_conn, reconcile_sorted(iter_sheet_rows(sheet_conn), db_rows))
+
+            for kind, count in counts.items():
+                metrics.incr(f"rows_{kind}", count)
+            logging.info(
+                f"✅ Reconciled the sheet with {source}: {counts['only_in_sheet']} only in the sheet, "
+                f"{counts['only_in_db']} only in the database, {counts['different']} with a different "
+                f"manufacture_date. Report written to {report_db}."
+            )
+
+            if apply_updates and counts["different"]:
+                cursor = report_conn.execute("SELECT serial_number, sheet_date FROM different WHERE sheet_date IS NOT NULL")
+                updates = cursor.fetchall()
+                skipped = counts["different"] - len(updates)
+                if skipped:
+                    logging.warning(f"Not clearing manufacture_date of {skipped} rows whose sheet date is missing or unparseable.")
+                if updates:
+                    with metrics.stage("update"):
+                        update_manufacture_dates(pg_conn, updates)
+        return counts
+    finally:
+        if pg_conn is not None:
+            pg_conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile the processed sheet with the cookstoves data in both directions.")
+    parser.add_argument(
+        "--live", action="store_true",
+        help=f"compare against the PostgreSQL table instead of the {LOCAL_DB} snapshot"
+    )
+    parser.add_argument(
+        "--apply-updates", action="store_true",
+        help="with --live, set the PostgreSQL manufacture_date of mismatched rows to the sheet's date"
+    )
+    parser.add_argument("--report", default=REPORT_DB, help=f"SQLite file for the report (default: {REPORT_DB})")
+    args = parser.parse_args()
+    if args.apply_updates and not args.live:
+        parser.error("--apply-updates requires --live")
+    logging.info("🚀 Reconciliation started")
+    try:
+        reconcile(live=args.live, apply_updates=args.apply_updates, report_db=args.report)
+    except Exception as e:
+        logging.error(f"❌ Reconciliation failed: {e}")
+        raise
+    finally:
+        metrics.write("reconcile")
+    logging.info("🏁 Reconciliation completed.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import logging
+import numpy as np
+
+# Bloom filter sizing: ~1% false positives at 10 bits and 7 hashes per key
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+def _encode(serial_numbers):
+    """Encode serial numbers as a NumPy fixed-width byte-string array."""
+    serial_numbers = list(serial_numbers)
+    try:
+        return np.array(serial_numbers, dtype=np.bytes_)
+    except UnicodeEncodeError:
+        return np.array([str(serial).encode("utf-8") for serial in serial_numbers], dtype=np.bytes_)
+
+def _hash_keys(keys):
+    """Vectorised 64-bit FNV-1a hash of every key of a fixed-width byte-string array."""
+    columns = keys.view(np.uint8).reshape(len(keys), keys.dtype.itemsize)
+    hashes = np.full(len(keys), FNV_OFFSET, dtype=np.uint64)
+    for column in columns.T:
+        hashes ^= column.astype(np.uint64)
+        hashes *= FNV_PRIME
+    return hashes
+
+def _bloom_positions(keys, bit_count):
+    """Return the (len(keys), BLOOM_HASHES) bit positions of the keys (double hashing)."""
+    first = _hash_keys(keys)
+    second = (first >> np.uint64(29)) * np.uint64(0x9e3779b97f4a7c15) | np.uint64(1)
+    steps = np.arange(BLOOM_HASHES, dtype=np.uint64)
+    return (first[:, None] + steps[None, :] * second[:, None]) % np.uint64(bit_count)
+
+class SerialIndex:
+    """
+    Compact index of known serial numbers.
+
+    Serials are kept once, as a sorted fixed-width byte array, with a Bloom
+    filter in front of it. contains() answers a whole batch of candidates in
+    vectorised calls: the Bloom filter rules out most absent serials and a
+    binary search (np.searchsorted) confirms the rest.
+    """
+
+    def __init__(self, keys, bloom_bits):
+        self.keys = keys
+        self.bloom_bits = bloom_bits
+
+    @classmethod
+    def from_serials(cls, serial_numbers):
+        """Build an index from an iterable of serial numbers (None values are ignored)."""
+        keys = _encode(serial for serial in serial_numbers if serial is not None)
+        keys.sort()
+        if len(keys):
+            keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+
+        bit_count = max(64, len(keys) * BLOOM_BITS_PER_KEY)
+        bit_count += -bit_count % 8
+        bloom = np.zeros(bit_count, dtype=bool)
+        if len(keys):
+            bloom[_bloom_positions(keys, bit_count).ravel()] = True
+        return cls(keys, np.packbits(bloom, bitorder="little"))
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        """Memory used by the index arrays, in bytes."""
+        return self.keys.nbytes + self.bloom_bits.nbytes
+
+    def contains(self, serial_numbers):
+        """Return a boolean array telling which candidate serial numbers are in the index."""
+        candidates = _encode(serial_numbers)
+        present = np.zeros(len(candidates), dtype=bool)
+        if not len(candidates) or not len(self.keys):
+            return present
+
+        # Candidates wider than every known key cannot be present
+        fits = np.char.str_len(candidates) <= self.keys.dtype.itemsize
+        candidates = candidates.astype(self.keys.dtype)
+
+        bit_count = len(self.bloom_bits) * 8
+        positions = _bloom_positions(candidates, bit_count)
+        bits = (self.bloom_bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        maybe = fits & bits.all(axis=1)
+
+        checked = candidates[maybe]
+        slots = np.searchsorted(self.keys, checked)
+        slots[slots == len(self.keys)] = 0
+        present[maybe] = self.keys[slots] == checked
+        return present
+
+    def save(self, path, stamp):
+        """Persist the index with the stamp of the data it was built from."""
+        with open(path, "wb") as f:
+            np.savez(f, keys=self.keys, bloom_bits=self.bloom_bits, stamp=np.array(stamp))
+
+    @classmethod
+    def load(cls, path, stamp):
+        """Load a persisted index, or return None if it is missing or was built from other data."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if str(data["stamp"]) != stamp:
+                    return None
+                return cls(data["keys"], data["bloom_bits"])
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Ignoring unreadable serial index {path}: {e}")
+            return None
+
+def index_path(db_path, table_name):
+    """Return the path of the persisted index next to the database file."""
+    base, _ = os.path.splitext(db_path)
+    return f"{base}.{table_name}.serials.npz"
+
+def load_serial_index(db_path, table_name, column="serial_number"):
+    """
+    Return the SerialIndex of a SQLite table's serial numbers.
+    The index is persisted next to the database and reused while the database
+    file is unchanged (same size and modification time); otherwise it is rebuilt.
+    """
+    stat = os.stat(db_path)
+    stamp = f"{table_name}:{column}:{stat.st_size}:{stat.st_mtime_ns}"
+    path = index_path(db_path, table_name)
+
+    index = SerialIndex.load(path, stamp)
+    if index is not None:
+        logging.info(f"Loaded serial index of {db_path} ({len(index)} serials, {index.nbytes / 1048576:.1f} MiB).")
+        return index
+
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {column} FROM {table_name}")
+        index = SerialIndex.from_serials(row[0] for row in cursor)
+    index.save(path, stamp)
+    logging.info(f"Built serial index of {db_path} ({len(index)} serials, {index.nbytes / 1048576:.1f} MiB).")
+    return index
@@ -0,0 +1,177 @@
+import sqlite3
+import logging
+from collections import Counter
+
+# Journal of committed push batches kept in missing_data.db (see migrationtopsql.py)
+PUSH_JOURNAL_TABLE = "push_journal"
+
+# Pragmas applied to every intermediate SQLite store
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -65536,       # 64 MiB (negative values are KiB)
+    "mmap_size": 268435456,     # 256 MiB
+    "temp_store": "MEMORY",
+}
+
+def open_db(db_path):
+    """Connect to an intermediate SQLite store with the tuned pragmas applied."""
+    conn = sqlite3.connect(db_path)
+    for pragma, value in SQLITE_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+def ensure_unique_key(conn, table_name, column):
+    """
+    Create a unique index on `column` of the table if it does not exist yet.
+    Duplicate keys left by earlier append-only runs are removed first,
+    keeping the most recently inserted row.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA index_list({table_name})")
+    for _, name, unique, *_ in cursor.fetchall():
+        cursor.execute(f"PRAGMA index_info({name})")
+        if unique and [row[2] for row in cursor.fetchall()] == [column]:
+            return
+
+    index_name = f"idx_{table_name}_{column}_unique"
+    cursor.execute(f"""
+        DELETE FROM {table_name}
+        WHERE rowid NOT IN (SELECT MAX(rowid) FROM {table_name} GROUP BY {column})
+    """)
+    if cursor.rowcount:
+        logging.info(f"Removed {cursor.rowcount} duplicate rows from '{table_name}'.")
+    cursor.execute(f"CREATE UNIQUE INDEX {index_name} ON {table_name} ({column})")
+    conn.commit()
+
+def ensure_clean_record(conn):
+    """
+    Create the clean_record table of processed_data.db keyed on column_a (the
+    serial number). Each row records the sheet source and sync block it came
+    from, so the rows of a changed block can be replaced.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS clean_record (
+            column_a TEXT,
+            column_c TEXT,
+            source TEXT,
+            block INTEGER
+        )
+    """)
+    # Tables created before rows were tagged with their block get the columns added
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(clean_record)")]
+    for column, column_type in (("source", "TEXT"), ("block", "INTEGER")):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE clean_record ADD COLUMN {column} {column_type}")
+    ensure_unique_key(conn, "clean_record", "column_a")
+
+def ensure_missing_table(conn, table_name):
+    """Key the missing_data.db table on serial_number."""
+    ensure_unique_key(conn, table_name, "serial_number")
+
+def count_duplicates(serial_numbers, duplicates=None, seen=None):
+    """
+    Count, per serial number, how many extra times it appears in a batch.
+    Pass the same `seen` set across batches to also catch repeats between them.
+    """
+    duplicates = duplicates if duplicates is not None else Counter()
+    seen = seen if seen is not None else set()
+    for serial_number in serial_numbers:
+        if serial_number in seen:
+            duplicates[serial_number] += 1
+        else:
+            seen.add(serial_number)
+    return duplicates
+
+def log_duplicates(duplicates, source, kept="last one kept"):
+    """Log a single summary line for serial numbers that appeared more than once, saying which row was kept."""
+    if duplicates:
+        examples = ", ".join(serial for serial, _ in duplicates.most_common(5))
+        logging.warning(
+            f"{len(duplicates)} serial numbers appear more than once in {source} "
+            f"({sum(duplicates.values())} extra rows, {kept}), e.g. {examples}"
+        )
+
+def upsert_processed_rows(conn, rows, duplicates=None, seen=None, source=None, block=None, outranked_by=()):
+    """
+    Upsert processed [column_a, column_c] rows into clean_record keyed on column_a,
+    tagged with the sheet source and sync block they came from.
+    Rows without a serial number are skipped and repeated serial numbers are
+    counted in `duplicates` (see count_duplicates). When tagged, a row does not
+    replace one from a source in `outranked_by` or from a later block of the
+    same source, so the winner does not depend on the order pages are synced
+    in. Returns (rows written, rows without a serial number).
+    """
+    keyed_rows = [(row[0], row[1], source, block) for row in rows if row[0] != "NULL"]
+    count_duplicates((row[0] for row in keyed_rows), duplicates, seen)
+    precedence = ""
+    if source is not None:
+        precedence = """
+        WHERE clean_record.source IS NULL OR clean_record.block IS NULL OR (
+            clean_record.source NOT IN ({}) AND
+            NOT (clean_record.source = excluded.source AND clean_record.block > excluded.block)
+        )""".format(", ".join("?" * len(outranked_by)))
+        keyed_rows = [row + tuple(outranked_by) for row in keyed_rows]
+    cursor = conn.executemany(f"""
+        INSERT INTO clean_record (column_a, column_c, source, block)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (column_a) DO UPDATE SET
+            column_c = excluded.column_c,
+            source = excluded.source,
+            block = excluded.block{precedence}
+    """, keyed_rows)
+    return cursor.rowcount, len(rows) - len(keyed_rows)
+
+def delete_block_rows(conn, source, first_block, last_block=None):
+    """
+    Delete the clean_record rows synced from blocks first_block..last_block of
+    a source (every block from first_block on when last_block is None).
+    Returns the deleted count.
+    """
+    if last_block is None:
+        cursor = conn.execute("DELETE FROM clean_record WHERE source = ? AND block >= ?", (source, first_block))
+    else:
+        cursor = conn.execute(
+            "DELETE FROM clean_record WHERE source = ? AND block BETWEEN ? AND ?", (source, first_block, last_block)
+        )
+    return cursor.rowcount
+
+def count_untagged_rows(conn):
+    """Return the number of clean_record rows not tagged with a sync block (written by older runs or checkpoints)."""
+    cursor = conn.execute("SELECT COUNT(*) FROM clean_record WHERE source IS NULL OR block IS NULL")
+    return cursor.fetchone()[0]
+
+def upsert_missing_rows(conn, table_name, rows):
+    """Upsert (serial_number, manufacture_date) rows into the missing_data.db table."""
+    conn.executemany(f"""
+        INSERT INTO {table_name} (serial_number, manufacture_date)
+        VALUES (?, ?)
+        ON CONFLICT (serial_number) DO UPDATE SET manufacture_date = excluded.manufacture_date
+    """, rows)
+    return len(rows)
+
+def prune_missing_rows(conn, table_name, serial_numbers):
+    """
+    Delete the rows of the missing_data.db table whose serial number is not in
+    `serial_numbers` (the current missing set). Returns the deleted count.
+    The table's push journal checkpoints are cleared when rows are deleted,
+    since rows added later may reuse their rowids.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS current_missing (serial_number TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.current_missing")
+    conn.executemany(
+        "INSERT OR IGNORE INTO temp.current_missing (serial_number) VALUES (?)",
+        ((serial_number,) for serial_number in serial_numbers)
+    )
+    cursor = conn.execute(f"""
+        DELETE FROM {table_name}
+        WHERE serial_number NOT IN (SELECT serial_number FROM temp.current_missing)
+    """)
+    pruned = cursor.rowcount
+    conn.execute("DROP TABLE temp.current_missing")
+    if pruned:
+        cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (PUSH_JOURNAL_TABLE,))
+        if cursor.fetchone():
+            conn.execute(f"DELETE FROM {PUSH_JOURNAL_TABLE} WHERE source_table = ?", (table_name,))
+        logging.info(f"Removed {pruned} rows no longer missing from '{table_name}'.")
+    return pruned